@@ -1,69 +1,114 @@
-import pandas as pd
+import argparse
+import asyncio
+import json
+import os
+import orjson
 import csv
-import time
-import yaml
-from openai import OpenAI
+from openai import AsyncOpenAI
+from utils.misc import load_yaml
+from utils.llm_cache import LLMCache, cached_llm_call, make_cache_key
+from utils.openai_batch import run_chat_batch
+from utils.rate_limiter import TokenBucketLimiter, estimate_tokens
+
+# 同时在途的行数上限，超出部分由信号量排队；RPM/TPM由令牌桶限流
+MAX_CONCURRENCY = 32
+# 每次批量评审请求打包的样本数，共享同一段提示词前缀
+BATCH_SIZE = 20
 
 
 class AICodeReviewer:
     def __init__(self, config_path="AI_check_config.yaml"):
         # 从YAML文件加载配置
-        with open(config_path, 'r', encoding='utf-8') as f:
-            config = yaml.safe_load(f)
+        config = load_yaml(config_path)
         
         # 初始化阿里云百炼API客户端
-        self.ai_client = OpenAI(
+        self.ai_client = AsyncOpenAI(
             api_key=config["api_key"],
             base_url=config["base_url"]
         )
         self.model_name = config["model_name_1"]
+        # 按模型的RPM/TPM额度主动限流，额度充足时不等待
+        self.rate_limiter = TokenBucketLimiter(
+            config.get("max_requests_per_minute", 600),
+            config.get("max_tokens_per_minute", 1000000)
+        )
+        # 持久化响应缓存，重复运行时相同请求直接命中
+        self.llm_cache = LLMCache(config.get("llm_cache_path", ".llm_cache.db"))
 
-    # 第一次评审：检查bad_code是否正确
-    def first_review(self, bad_code):
+    # 统一的大模型调用入口，按(模型, 消息, 采样参数)缓存返回内容
+    @cached_llm_call
+    async def _chat(self, model, messages, temperature, max_tokens, **extra):
+        await self.rate_limiter.acquire(estimate_tokens(messages, max_tokens))
+        raw = await self.ai_client.chat.completions.with_raw_response.create(
+            model=model,
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            **extra
+        )
+        self.rate_limiter.update_from_headers(raw.headers)
+        response = raw.parse()
+        choice = response.choices[0]
+        # 达到max_tokens被截断的回答无法使用，抛出异常既不写入缓存，也让调用方走默认值
+        if choice.finish_reason == "length":
+            raise ValueError("返回内容超过max_tokens被截断")
+        return choice.message.content
+
+    # 第一次评审并修正的请求参数(在线调用和离线批处理共用)：一次请求判断bad_code是否正确，为"错"时同时给出修正代码
+    # 与原先的generate_fixed_code一样只提供bad_code，修复不会参考人工修正的正确代码；评分仍由second_review单独完成
+    def review_fix_request(self, bad_code):
         prompt = f"""你是一个专业的代码评审员：
-请检查以下代码是否存在错误：
+请检查以下代码是否存在错误，结论为"对"或"错"；如果结论为"错"，请修复其中的错误，给出修复后的代码(fixed_code)。
 
 {bad_code}
 
-请只回答"对"或"错"，不要添加其他解释。"""
-        
-        try:
-            response = self.ai_client.chat.completions.create(
-                model=self.model_name,  # 使用配置文件中的模型名称
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=10,
-                temperature=0.1
-            )
-            result = response.choices[0].message.content.strip()
-            return result
-        except Exception as e:
-            print(f"Error in first review: {e}")
-            return "错"  # 默认认为是错误的
+请只返回JSON: {{"verdict": "对"|"错", "fixed_code": "..."}}，结论为"对"时fixed_code返回空字符串，不要添加其他解释。"""
 
-    # 如果第一次评审结果为"错"，则生成修正代码
-    def generate_fixed_code(self, bad_code):
-        prompt = f"""你是一个专业的代码工程师:
-以下代码存在错误：
+        return {
+            "model": self.model_name,  # 使用配置文件中的模型名称
+            "messages": [{"role": "user", "content": prompt}],
+            # 修正代码在JSON中需要转义，比单独返回代码时的1000留出更多余量
+            "max_tokens": 2000,
+            "temperature": 0.1,
+            "response_format": {"type": "json_object"}  # 由服务端保证返回合法JSON
+        }
 
-{bad_code}
+    # 解析第一次评审的返回内容，返回(结论, 修正代码)；内容缺失或格式不符时抛出异常
+    @staticmethod
+    def load_review_fix(content, bad_code):
+        if content is None:
+            raise ValueError("没有返回内容")
+        result = orjson.loads(content)
+        verdict = str(result.get("verdict", "错")).strip()
+        # 模型可能返回非字符串的JSON值，统一转为str，保证写出的每一列类型一致
+        fixed_code = result.get("fixed_code")
+        return verdict, str(fixed_code) if fixed_code else bad_code
 
-请修复以上代码中的错误，并只返回修复后的代码，不要添加任何解释或其他内容。"""
-        
+    # 返回内容能否正常解析；只有能解析的回答才写入响应缓存，格式错误的回答下次运行时重新请求
+    @classmethod
+    def is_valid_review_fix(cls, content):
+        return _parses(cls.load_review_fix, content, "")
+
+    # 解析第一次评审的返回内容，content为None(请求失败)或无法解析时返回默认值
+    @classmethod
+    def parse_review_fix(cls, content, bad_code):
         try:
-            response = self.ai_client.chat.completions.create(
-                model=self.model_name,  # 使用配置文件中的模型名称
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=1000,
-                temperature=0.3
-            )
-            fixed_code = response.choices[0].message.content.strip()
-            return fixed_code
+            return cls.load_review_fix(content, bad_code)
         except Exception as e:
-            print(f"Error in generating fixed code: {e}")
-            return bad_code  # 出错时返回原始代码
+            print(f"Error in review fix: {e}")
+            return "错", bad_code  # 出错时默认认为是错误的，修正代码为原始代码
+
+    # 第一次评审并修正
+    async def review_fix(self, bad_code):
+        try:
+            content = await self._chat(**self.review_fix_request(bad_code), cache_if=self.is_valid_review_fix)
+        except Exception as e:
+            print(f"Error in review fix: {e}")
+            content = None
+        return self.parse_review_fix(content, bad_code)
 
     # 第二次评审：比较AI修正代码与正确代码的相似度并评分
-    def second_review(self, ai_code, good_code, bad_code, bug_analysis):
+    async def second_review(self, ai_code, good_code, bad_code, bug_analysis):
         prompt = f"""你是一个专业严格的代码评审员
         
 通过与good_code(正确)和bad_code(有Bug)对比, 评估ai_code对bug的修复成功度，并给出0-100的评分。
@@ -79,80 +124,272 @@ AI修正代码：
 请先返回评分数字，然后换行返回是否适合作为训练集（是/否）。不要添加其他解释。"""
         
         try:
-            response = self.ai_client.chat.completions.create(
+            content = await self._chat(
                 model=self.model_name,  # 使用配置文件中的模型名称
                 messages=[{"role": "user", "content": prompt}],
                 max_tokens=100,
-                temperature=0.1  # 降低温度参数以获得更一致的评分
+                temperature=0.1,  # 降低温度参数以获得更一致的评分
+                cache_if=self.is_valid_second_review
             )
-            result = response.choices[0].message.content.strip().split('\n')
-            score = int(result[0])
-            is_suitable = result[1] if len(result) > 1 else "否"
-            return score, is_suitable
+            return self.load_second_review(content)
         except Exception as e:
             print(f"Error in second review: {e}")
             return 0, "否"  # 出错时返回0分和否
 
+    # 解析单个第二次评审的返回内容：第一行为评分，第二行为是否适合；格式不符时抛出异常
+    @staticmethod
+    def load_second_review(content):
+        result = content.strip().split('\n')
+        score = int(result[0])
+        is_suitable = result[1] if len(result) > 1 else "否"
+        return score, is_suitable
+
+    # 单个第二次评审的返回内容能否正常解析
+    @classmethod
+    def is_valid_second_review(cls, content):
+        return _parses(cls.load_second_review, content)
+
+    # 批量第二次评审的请求参数：items为(ai_code, good_code, bad_code, bug_analysis)列表，所有样本共享同一段提示词
+    def second_review_batch_request(self, items):
+        samples = "\n\n".join(
+            f"""样本{i}:
+原始错误代码：{bad_code}
+错误分析：{bug_analysis}
+人工修正的正确代码：
+{good_code}
+AI修正代码：
+{ai_code}"""
+            for i, (ai_code, good_code, bad_code, bug_analysis) in enumerate(items, 1)
+        )
+        prompt = f"""你是一个专业严格的代码评审员
+
+以下共有{len(items)}个样本。对每个样本，通过与good_code(正确)和bad_code(有Bug)对比, 评估ai_code对bug的修复成功度，并给出0-100的评分。
+同时，请判断这组代码（bad_code, good_code, bug_analysis）是否适合作为微调"代码评审大模型"的训练集。请回答"是"或"否"。
+
+{samples}
+
+请只返回一个JSON数组，按样本顺序每个元素为{{"score": 评分数字, "suitable": "是"或"否"}}。不要添加其他解释。"""
+
+        return {
+            "model": self.model_name,  # 使用配置文件中的模型名称
+            "messages": [{"role": "user", "content": prompt}],
+            "max_tokens": 30 * len(items) + 20,
+            "temperature": 0.1  # 降低温度参数以获得更一致的评分
+        }
+
+    # 解析批量第二次评审的返回内容，返回(评分, 是否适合)列表；内容缺失或格式不符时抛出异常
+    @staticmethod
+    def parse_second_review_batch(content, count):
+        if content is None:
+            raise ValueError("没有返回内容")
+        reviews = _parse_json_list(content, count)
+        # 模型可能返回非字符串的JSON值，统一转为str，保证写出的每一列类型一致
+        return [(int(r["score"]), str(r.get("suitable", "否")).strip()) for r in reviews]
+
+    # 批量第二次评审的返回内容能否正常解析出count个结果
+    @classmethod
+    def is_valid_second_review_batch(cls, content, count):
+        return _parses(cls.parse_second_review_batch, content, count)
+
+    # 批量第二次评审：items为(ai_code, good_code, bad_code, bug_analysis)列表，返回(评分, 是否适合)列表
+    async def second_review_batch(self, items):
+        try:
+            content = await self._chat(
+                **self.second_review_batch_request(items),
+                cache_if=lambda content: self.is_valid_second_review_batch(content, len(items))
+            )
+            return self.parse_second_review_batch(content, len(items))
+        except Exception as e:
+            print(f"Error in batch second review, falling back to single review: {e}")
+            return list(await asyncio.gather(*(self.second_review(*item) for item in items)))
 
-# 读取CSV文件
+
+# 用load解析返回内容，能正常解析时返回True
+def _parses(load, content, *args):
+    try:
+        load(content, *args)
+        return True
+    except Exception:
+        return False
+
+
+# 解析模型返回的JSON数组，兼容```json代码块包裹，长度不符时抛出异常
+def _parse_json_list(content, expected_len):
+    content = content.strip()
+    if content.startswith("```"):
+        content = content.strip("`").strip()
+        if content.startswith("json"):
+            content = content[4:]
+    result = json.loads(content)
+    if not isinstance(result, list) or len(result) != expected_len:
+        raise ValueError(f"期望长度为{expected_len}的JSON数组，实际得到: {content[:100]}")
+    return result
+
+
+# 读取CSV文件，返回(列名列表, 行字典列表)
 def read_csv_data(file_path):
-    df = pd.read_csv(file_path)
-    return df
+    with open(file_path, newline='', encoding='utf-8') as f:
+        reader = csv.DictReader(f)
+        return list(reader.fieldnames), list(reader)
+
+
+# 写出CSV文件，所有值加引号
+def write_csv_data(fieldnames, rows, file_path):
+    with open(file_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames, quoting=csv.QUOTE_ALL)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+# 在信号量保护下执行一次API调用
+async def _limited(sem, coro):
+    async with sem:
+        return await coro
+
+
+# 根据第一次评审的(结论, 修正代码)生成每行的结果[行号, 结论, ai_code, 评分, 是否适合]
+# 返回(结果列表, 结论为"错"的结果下标, 这些行的第二次评审样本)
+def _first_results(batch, reviews):
+    results = []
+    wrong = []
+    items = []
+    for (pos, bad_code, good_code, bug_analysis), (verdict, fixed_code) in zip(batch, reviews):
+        if verdict == "错":
+            wrong.append(len(results))
+            items.append((fixed_code, good_code, bad_code, bug_analysis))
+            results.append([pos, verdict, fixed_code, 0, "否"])
+        else:
+            # 如果第一次评审结果为"对"，则不需要修正，相似度为100
+            results.append([pos, verdict, bad_code, 100, "是"])
+    return results, wrong, items
+
+
+# 处理一批数据：逐行第一次评审并修正 → 为"错"的行批量第二次评审
+# batch中每个元素为(行号, bad_code, good_code, bug_analysis)
+async def process_batch(reviewer, sem, batch, total):
+    print(f"Processing rows {batch[0][0]+1}-{batch[-1][0]+1}/{total}")
+
+    # 第一次评审，同时得到修正代码
+    reviews = await asyncio.gather(*(
+        _limited(sem, reviewer.review_fix(bad_code)) for _, bad_code, _, _ in batch
+    ))
+    results, wrong, items = _first_results(batch, reviews)
+
+    # 第二次评审：为"错"的行计算相似度评分
+    if items:
+        second_results = await _limited(sem, reviewer.second_review_batch(items))
+        for i, (score, is_suitable) in zip(wrong, second_results):
+            results[i][3], results[i][4] = score, is_suitable
+
+    return [tuple(result) for result in results]
+
+
+# 离线批处理：未命中缓存的请求打包为Batch API任务，费用约为在线调用的一半且不受RPM限制
+# 第一次评审每行一个请求；第二次评审只包含结论为"错"的行，与在线模式一样每BATCH_SIZE行打包为一个请求
+async def review_rows_offline(reviewer, batch, work_dir):
+    contents = await _chat_offline(
+        reviewer,
+        {str(pos): reviewer.review_fix_request(bad_code) for pos, bad_code, _, _ in batch},
+        work_dir,
+        lambda custom_id, content: reviewer.is_valid_review_fix(content)
+    )
+    reviews = [reviewer.parse_review_fix(contents.get(str(pos)), bad_code) for pos, bad_code, _, _ in batch]
+    results, wrong, items = _first_results(batch, reviews)
+
+    starts = range(0, len(items), BATCH_SIZE)
+    counts = {str(start): len(items[start:start + BATCH_SIZE]) for start in starts}
+    contents = await _chat_offline(
+        reviewer,
+        {str(start): reviewer.second_review_batch_request(items[start:start + BATCH_SIZE]) for start in starts},
+        os.path.join(work_dir, "second_review"),
+        lambda custom_id, content: reviewer.is_valid_second_review_batch(content, counts[custom_id])
+    )
+    for start in starts:
+        try:
+            second_results = reviewer.parse_second_review_batch(
+                contents.get(str(start)), len(items[start:start + BATCH_SIZE])
+            )
+        except Exception as e:
+            print(f"Error in batch second review: {e}")
+            continue  # 保留0分和否
+        for i, (score, is_suitable) in zip(wrong[start:start + BATCH_SIZE], second_results):
+            results[i][3], results[i][4] = score, is_suitable
+
+    return [tuple(result) for result in results]
+
+
+# 离线提交一组请求(custom_id -> 请求体)：与在线调用共用_chat的缓存键，已缓存的请求不再提交
+# is_valid(custom_id, content)校验不通过的回答不写入缓存，与在线调用的cache_if一致
+async def _chat_offline(reviewer, bodies, work_dir, is_valid):
+    cache = reviewer.llm_cache
+    contents = {}
+    requests = []
+    keys = {}
+    for custom_id, body in bodies.items():
+        keys[custom_id] = make_cache_key(**body)
+        cached = cache.get(keys[custom_id]) if cache is not None else None
+        if cached is not None:
+            contents[custom_id] = cached
+        else:
+            requests.append((custom_id, body))
+
+    fetched = await run_chat_batch(reviewer.ai_client, requests, work_dir)
+    if cache is not None:
+        for custom_id, content in fetched.items():
+            if is_valid(custom_id, content):
+                cache.set(keys[custom_id], content)
+    contents.update(fetched)
+    return contents
 
 
 # 主函数
-def main():
+async def main(offline_batch=False):
     # 创建AI代码评审器实例，传入配置文件路径
     reviewer = AICodeReviewer("AI_check_config.yaml")
     
     # 读取数据
     file_path = "strict_bugfixes/bugfix_analysis.csv"
-    df = read_csv_data(file_path)
+    fieldnames, rows = read_csv_data(file_path)
+    total = len(rows)
     
     # 添加新列用于存储结果
-    df['first_review'] = ''
-    df['ai_code'] = ''
-    df['similarity_score'] = 0
-    df['suitable_for_training'] = ''
+    fieldnames += ['first_review', 'ai_code', 'similarity_score', 'suitable_for_training']
+    for row in rows:
+        row.update(first_review='', ai_code='', similarity_score=0, suitable_for_training='')
     
-    # 处理每一行数据
-    for index, row in df.iterrows():
-        bad_code = row['bad_code']
-        good_code = row['good_code']
-        bug_analysis = row['bug_analysis']  
-        
-        # 跳过空行
-        if pd.isna(bad_code) or pd.isna(good_code):
-            continue
-        
-        print(f"Processing row {index+1}/{len(df)}")
-        
-        # 第一次评审
-        first_result = reviewer.first_review(bad_code)
-        df.at[index, 'first_review'] = first_result
-        
-        # 如果第一次评审结果为"错"，则生成修正代码
-        if first_result == "错":
-            ai_code = reviewer.generate_fixed_code(bad_code)
-            df.at[index, 'ai_code'] = ai_code
-            
-            # 第二次评审：计算相似度评分
-            score, is_suitable = reviewer.second_review(ai_code, good_code, bad_code, bug_analysis)
-            df.at[index, 'similarity_score'] = score
-            df.at[index, 'suitable_for_training'] = is_suitable
-        else:
-            # 如果第一次评审结果为"对"，则不需要修正，相似度为100
-            df.at[index, 'ai_code'] = bad_code
-            df.at[index, 'similarity_score'] = 100
-            df.at[index, 'suitable_for_training'] = "是"
-        
-        # 添加延迟以避免API调用频率过高
-        time.sleep(1)
+    # 跳过空行，按BATCH_SIZE分批并发处理
+    items = [
+        (pos, row['bad_code'], row['good_code'], row['bug_analysis'])
+        for pos, row in enumerate(rows)
+        if row['bad_code'] and row['good_code']
+    ]
+    if offline_batch:
+        results = await review_rows_offline(reviewer, items, "strict_bugfixes/batch")
+    else:
+        batches = [items[i:i + BATCH_SIZE] for i in range(0, len(items), BATCH_SIZE)]
+        sem = asyncio.Semaphore(MAX_CONCURRENCY)
+        batch_results = await asyncio.gather(*(
+            process_batch(reviewer, sem, batch, total) for batch in batches
+        ))
+        results = [result for batch in batch_results for result in batch]
+
+    # 按行号回填结果
+    for pos, first_result, ai_code, score, is_suitable in results:
+        rows[pos].update(
+            first_review=first_result,
+            ai_code=ai_code,
+            similarity_score=score,
+            suitable_for_training=is_suitable
+        )
     
     # 保存结果到新的CSV文件
-    df.to_csv("strict_bugfixes/bugfix_analysis_results.csv", index=False, quoting=csv.QUOTE_ALL)
+    write_csv_data(fieldnames, rows, "strict_bugfixes/bugfix_analysis_results.csv")
     print("Processing complete. Results saved to bugfix_analysis_results.csv")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="AI代码评审")
+    parser.add_argument("--offline-batch", action="store_true",
+                        help="通过OpenAI Batch API离线提交(24小时内完成，费用减半)")
+    args = parser.parse_args()
+    asyncio.run(main(offline_batch=args.offline_batch))
\ No newline at end of file
@@ -1,79 +1,302 @@
-import requests
+import argparse
+import asyncio
+import httpx
+import ijson
 import base64
-import json
+import binascii
+import hashlib
+import orjson
 import os
 import re
 import csv
-import yaml
+import socket
 from urllib.parse import quote
-from typing import List, Dict, Tuple
-from openai import OpenAI  # 修改为使用OpenAI兼容接口
+from collections import OrderedDict
+from typing import AsyncIterable, AsyncIterator, Dict, Iterable, List, Optional, Tuple, Union
+from openai import AsyncOpenAI  # 修改为使用OpenAI兼容接口
+from utils.misc import load_yaml
+from utils.llm_cache import LLMCache, cached_llm_call, make_cache_key
+from utils.semantic_cache import SemanticCache
+from utils.openai_batch import run_chat_batch
+from utils.rate_limiter import TokenBucketLimiter, estimate_tokens
+
+try:
+    import ahocorasick
+except ImportError:  # 未安装pyahocorasick时退回子串匹配
+    ahocorasick = None
+
+# 默认的bug关键词，匹配时不区分大小写
+_DEFAULT_KWS = ("bug", "错误", "修复")
+# 关键词数达到该值且安装了pyahocorasick时，改用Aho-Corasick自动机匹配
+_AHOCORASICK_MIN_KWS = 16
+# 进程内AI分析结果的最大缓存条数
+_ANALYSIS_MEMO_SIZE = 4096
+# Gerrit请求遇到这些状态码时按退避重试
+_RETRY_STATUS = (500, 502, 503, 504)
+_RETRY_TOTAL = 3
+_RETRY_BACKOFF = 0.2
+# 下载→AI分析流水线的队列长度和AI消费者数量
+_QUEUE_SIZE = 64
+_CONSUMERS = 16
+# 关键词筛选时每匹配这么多个变更输出一次进度
+_PROGRESS_EVERY = 100
+# 注释行：//、/*、块注释续行的*，以及#开头但不是预处理指令的行
+_COMMENT_LINE_RE = re.compile(
+    r'^\s*(//|/\*|\*(\s|/|$)|#(?!\s*(include|define|undef|if|ifdef|ifndef|elif|else|endif|pragma|error|warning|line)\b))'
+)
+# 导入行：Python的import/from以及C/C++的#include
+_IMPORT_LINE_RE = re.compile(r'^\s*(import|from)\s|^\s*#\s*include\b')
+
+
+class _KeywordMatcher:
+    """
+    不区分大小写的关键词匹配器
+
+    关键词较少时逐个做子串查找；关键词较多时构建一次Aho-Corasick自动机，
+    每个subject只需扫描一遍，耗时与关键词数量无关。
+    """
+
+    def __init__(self, keywords: Iterable[str]):
+        # 统一casefold并去重，"Bug"/"BUG"/"bug"只保留一个
+        self.keywords = tuple(dict.fromkeys(k.casefold() for k in keywords))
+        self._automaton = None
+        if ahocorasick is not None and len(self.keywords) >= _AHOCORASICK_MIN_KWS:
+            automaton = ahocorasick.Automaton()
+            for i, keyword in enumerate(self.keywords):
+                automaton.add_word(keyword, i)
+            automaton.make_automaton()
+            self._automaton = automaton
+
+    def search(self, text: str) -> bool:
+        """text中是否包含任一关键词"""
+        text = text.casefold()
+        if self._automaton is not None:
+            return next(self._automaton.iter(text), None) is not None
+        return any(k in text for k in self.keywords)
+
+    def findall(self, text: str) -> List[str]:
+        """返回text中出现的全部关键词(按关键词顺序去重)"""
+        text = text.casefold()
+        if self._automaton is not None:
+            hits = {i for _, i in self._automaton.iter(text)}
+            return [self.keywords[i] for i in sorted(hits)]
+        return [k for k in self.keywords if k in text]
+
+
+class _GerritStreamReader:
+    """把httpx的异步字节流包装成ijson可读的异步文件对象，同时去掉Gerrit的)]}'前缀"""
+
+    def __init__(self, chunks: AsyncIterator[bytes]):
+        self._chunks = chunks
+        self._buffer = b""
+        self._eof = False
+        self._prefix_checked = False
+
+    async def _fill(self) -> None:
+        try:
+            self._buffer += await self._chunks.__anext__()
+        except StopAsyncIteration:
+            self._eof = True
+
+    async def read(self, size: int = -1) -> bytes:
+        if not self._prefix_checked:
+            # 前缀可能被拆在多个chunk中，攒够4个有效字节再判断
+            while not self._eof and len(self._buffer.lstrip()) < 4:
+                await self._fill()
+            self._buffer = self._buffer.lstrip()
+            if self._buffer.startswith(b")]}'"):
+                self._buffer = self._buffer[4:]
+            self._prefix_checked = True
+
+        while not self._buffer and not self._eof:
+            await self._fill()
+        if size is None or size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
 
 
 class GerritClient:
     def __init__(self, config_path="gerrit_AI_config.yaml"):
         # 从YAML文件加载配置
-        with open(config_path, 'r', encoding='utf-8') as f:
-            self.config = yaml.safe_load(f)
+        self.config = load_yaml(config_path)
         
         self.host = self.config["host"]
-        self.session = requests.Session()
-        self.session.auth = (self.config["username"], self.config["password"])
-        self.session.headers.update({
-            'Accept': 'text/plain',
-            'X-Gerrit-Auth': 'X'
-        })
+        # 显式配置连接池并开启TCP keepalive，连接失败由transport重试
+        transport = httpx.AsyncHTTPTransport(
+            http2=True,
+            retries=_RETRY_TOTAL,
+            limits=httpx.Limits(max_connections=64, max_keepalive_connections=32, keepalive_expiry=60),
+            socket_options=[(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+        )
+        self.session = httpx.AsyncClient(
+            transport=transport,
+            auth=(self.config["username"], self.config["password"]),
+            headers={
+                'Accept': 'text/plain',
+                'X-Gerrit-Auth': 'X'
+            },
+            timeout=30
+        )
+        # 限制同时在途的AI分析请求数
+        self._ai_sem = asyncio.Semaphore(16)
         # 初始化阿里云百炼API客户端
-        self.ai_client = OpenAI(
+        self.ai_client = AsyncOpenAI(
             api_key=self.config["api_key"],
             base_url=self.config["base_url"]
         )
+        # 按模型的RPM/TPM额度主动限流，额度充足时不等待
+        self.rate_limiter = TokenBucketLimiter(
+            self.config.get("max_requests_per_minute", 600),
+            self.config.get("max_tokens_per_minute", 1000000)
+        )
+        # 持久化响应缓存，重复运行时相同请求直接命中；AI分析结果跨运行只保存这一份
+        self.llm_cache = LLMCache(self.config.get("llm_cache_path", ".llm_cache.db"))
+        # AI分析结果缓存：进程内按内容哈希去重
+        self._analysis_memo = OrderedDict()
+        self.semantic_cache = None
+
+    async def aclose(self):
+        """关闭Gerrit与AI客户端的连接池以及响应缓存"""
+        await self.session.aclose()
+        await self.ai_client.close()
+        self.llm_cache.close()
+
+    async def _get(self, url: str) -> httpx.Response:
+        """GET请求，服务端5xx时按指数退避重试"""
+        for attempt in range(_RETRY_TOTAL + 1):
+            response = await self.session.get(url)
+            if response.status_code not in _RETRY_STATUS or attempt == _RETRY_TOTAL:
+                return response
+            await asyncio.sleep(_RETRY_BACKOFF * (2 ** attempt))
 
-    def _make_gerrit_request(self, url: str) -> dict:
+    async def _make_gerrit_request(self, url: str) -> dict:
         """处理Gerrit的特殊响应格式"""
-        response = self.session.get(url)
+        response = await self._get(url)
         if response.status_code == 200:
-            content = response.text.strip()
-            if content.startswith(")]}'"):
-                return json.loads(content[4:])
-            return json.loads(content)
+            # 直接解析原始bytes，省去一次UTF-8解码
+            content = response.content.lstrip()
+            if content.startswith(b")]}'"):
+                content = content[4:]
+            return orjson.loads(content)
         raise Exception(f"请求失败: HTTP {response.status_code}")
 
-    def get_project_changes(self, project_name: str, limit: int = 500) -> list:
-        """获取项目的所有变更列表"""
+    async def _iter_gerrit_items(self, url: str) -> AsyncIterator[Dict]:
+        """流式请求返回JSON数组的Gerrit接口，边下载边逐个产出数组元素"""
+        async with self.session.stream("GET", url) as response:
+            if response.status_code != 200:
+                raise Exception(f"请求失败: HTTP {response.status_code}")
+            reader = _GerritStreamReader(response.aiter_bytes())
+            async for item in ijson.items(reader, 'item'):
+                yield item
+
+    async def get_project_changes(self, project_name: str, limit: int = 500) -> AsyncIterator[Dict]:
+        """流式获取项目的所有变更列表，逐个产出变更"""
         url = f"http://{self.host}/a/changes/?q=project:{project_name}+status:merged&n={limit}"
-        return self._make_gerrit_request(url)
+        async for change in self._iter_gerrit_items(url):
+            yield change
 
-    def get_change_files(self, change_id: str) -> list:
+    async def get_change_files(self, change_id: str) -> list:
         """获取变更中所有修改的文件"""
         url = f"http://{self.host}/a/changes/{change_id}/revisions/current/files/"
-        files = self._make_gerrit_request(url)
+        files = await self._make_gerrit_request(url)
         return [file_path for file_path in files.keys() if file_path != "/COMMIT_MSG"]
 
-    def get_well_formatted_patch(self, change_id: str, file_path: str) -> str:
+    async def get_well_formatted_patch(self, change_id: str, file_path: str) -> str:
         """获取格式良好的patch内容"""
         encoded_path = quote(file_path, safe='')
         url = f"http://{self.host}/a/changes/{change_id}/revisions/current/patch?path={encoded_path}"
         
-        response = self.session.get(url)
-        if not response.ok:
+        response = await self._get(url)
+        if not response.is_success:
             raise Exception(f"获取patch失败: HTTP {response.status_code}")
         
+        # 直接对原始bytes做base64解码，避免先解码成str再编码回bytes
         try:
-            decoded = base64.b64decode(response.text).decode('utf-8')
-        except:
+            decoded = base64.b64decode(response.content, validate=False).decode('utf-8')
+        except (binascii.Error, UnicodeDecodeError):
             decoded = response.text
         
-        return decoded.replace('\r\n', '\n').replace('\r', '\n') + ('\n' if not decoded.endswith('\n') else '')
+        # 绝大多数patch不含\r，只有存在时才做换行归一化
+        if '\r' in decoded:
+            decoded = decoded.replace('\r\n', '\n').replace('\r', '\n')
+        return decoded if decoded.endswith('\n') else decoded + '\n'
+
+    @cached_llm_call
+    async def _chat(self, model, messages, temperature, max_tokens):
+        """统一的大模型调用入口，按(模型, 消息, 采样参数)缓存返回内容"""
+        await self.rate_limiter.acquire(estimate_tokens(messages, max_tokens))
+        raw = await self.ai_client.chat.completions.with_raw_response.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens
+        )
+        self.rate_limiter.update_from_headers(raw.headers)
+        response = raw.parse()
+        choice = response.choices[0]
+        # 达到max_tokens被截断的回答不写入缓存，按调用失败处理
+        if choice.finish_reason == "length":
+            raise ValueError("返回内容超过max_tokens被截断")
+        return choice.message.content
 
-    def _analyze_bug_with_ai(self, diff_content: str, change_subject: str) -> Tuple[bool, str, str]:
+    async def _analyze_bug_with_ai(self, bad_code: str, good_code: str, change_subject: str) -> Tuple[bool, str, str]:
         """
         使用阿里云百炼(qwen-plus)模型分析bug类型和描述
         返回: (是否有效bug, bug类型, bug描述)
+
+        只把删除/新增的代码行发给模型，不带@@头和上下文行，减少输入token；
+        按sha256(变更描述+代码变更)缓存结果，cherry-pick/rebase产生的重复patch只分析一次；
+        并发中的相同请求共享同一个任务。
         """
-        if not diff_content:
+        if not bad_code and not good_code:
             return False, "", ""
 
+        diff_content = self._compact_diff(bad_code, good_code)
+
+        key = self._analysis_key(diff_content, change_subject)
+        task = self._analysis_memo.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._analyze_uncached(key, diff_content, change_subject))
+            self._analysis_memo[key] = task
+            if len(self._analysis_memo) > _ANALYSIS_MEMO_SIZE:
+                self._analysis_memo.popitem(last=False)
+        else:
+            self._analysis_memo.move_to_end(key)
+        return await task
+
+    def _compact_diff(self, bad_code: str, good_code: str) -> str:
+        """由_split_patch的结果拼出发送给模型的精简变更"""
+        return f"\n[修改前]\n{bad_code}\n[修改后]\n{good_code}"
+
+    def _analysis_key(self, diff_content: str, change_subject: str) -> str:
+        """AI分析结果的缓存键"""
+        return hashlib.sha256((change_subject + "\0" + diff_content).encode('utf-8')).hexdigest()
+
+    def _cached_analysis(self, request: Dict) -> Optional[Tuple[bool, str, str]]:
+        """按与_chat相同的缓存键查询响应缓存，命中时返回解析后的分析结果，在语义缓存之前查询"""
+        content = self.llm_cache.get(make_cache_key(**request))
+        if content is None:
+            return None
+        return self._parse_bug_analysis(content)
+
+    async def _lookup_analysis(self, diff_content: str) -> Optional[Tuple[bool, str, str]]:
+        """查询语义缓存，未启用或未命中返回None"""
+        # 语义缓存：不同写法但含义相同的patch复用已有结论；嵌入计算耗CPU，放到线程中避免阻塞事件循环。
+        # 只嵌入精简后的变更行，不带subject，尽量让整个变更落在嵌入模型的长度上限内
+        if self.semantic_cache is not None:
+            cached = await asyncio.to_thread(self.semantic_cache.lookup, diff_content)
+            if cached is not None:
+                return tuple(cached)
+        return None
+
+    async def _store_analysis(self, diff_content: str, result: Tuple[bool, str, str]) -> None:
+        """把一次成功的AI分析结果写入语义缓存"""
+        if self.semantic_cache is not None:
+            await asyncio.to_thread(self.semantic_cache.add, diff_content, list(result))
+
+    def _bug_analysis_request(self, diff_content: str, change_subject: str) -> Dict:
+        """AI分析的chat.completions请求参数，在线调用和离线批处理共用"""
         # 构造提示词
         prompt = f"""
         请严格分析以下代码变更是否是一个高价值的bug修复，并按要求回答。
@@ -101,146 +324,377 @@ class GerritClient:
         [描述]修复了车窗无法关闭的问题
         """
 
+        return {
+            "model": self.config["model_name"],
+            "messages": [
+                {"role": "system", "content": "你是一个严谨的代码审查助手，需要严格分析代码变更是否是高价值bug修复。"},
+                {"role": "user", "content": prompt}
+            ],
+            "temperature": 0.1,
+            "max_tokens": 100
+        }
+
+    @staticmethod
+    def _is_valid_bug_analysis(content: str) -> bool:
+        """回答是否包含[判断]结论；不含结论的回答不写入响应缓存，下次运行时重新请求"""
+        return content is not None and "[判断]" in content
+
+    def _parse_bug_analysis(self, content: str) -> Tuple[bool, str, str]:
+        """解析AI回答，返回(是否有效bug, bug类型, bug描述)"""
+        answer = content.strip()
+        
+        is_bug = False
+        bug_type = ""
+        bug_desc = ""
+        
+        if "[判断]是" in answer:
+            is_bug = True
+        
+        type_match = re.search(r'\[类型\](.*)', answer)
+        if type_match:
+            bug_type = type_match.group(1).strip()
+        
+        desc_match = re.search(r'\[描述\](.*)', answer)
+        if desc_match:
+            bug_desc = desc_match.group(1).strip()
+        
+        return is_bug, bug_type, bug_desc
+
+    async def _analyze_uncached(self, key: str, diff_content: str, change_subject: str) -> Tuple[bool, str, str]:
+        """
+        未命中进程内缓存时先查精确的响应缓存，再查近似的语义缓存，仍未命中再调用AI分析；
+        查询顺序与离线批处理的_collect_offline一致
+        """
+        request = self._bug_analysis_request(diff_content, change_subject)
+        cached = self._cached_analysis(request)
+        if cached is None:
+            cached = await self._lookup_analysis(diff_content)
+        if cached is not None:
+            return cached
+
         try:
-            response = self.ai_client.chat.completions.create(
-                model=self.config["model_name"],
-                messages=[
-                    {"role": "system", "content": "你是一个严谨的代码审查助手，需要严格分析代码变更是否是高价值bug修复。"},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.1,
-                max_tokens=100
-            )
-            
-            answer = response.choices[0].message.content.strip()
-            
-            # 解析AI回答
-            is_bug = False
-            bug_type = ""
-            bug_desc = ""
+            async with self._ai_sem:
+                content = await self._chat(
+                    **request,
+                    cache_if=self._is_valid_bug_analysis
+                )
             
-            if "[判断]是" in answer:
-                is_bug = True
-            
-            type_match = re.search(r'\[类型\](.*)', answer)
-            if type_match:
-                bug_type = type_match.group(1).strip()
-            
-            desc_match = re.search(r'\[描述\](.*)', answer)
-            if desc_match:
-                bug_desc = desc_match.group(1).strip()
-            
-            return is_bug, bug_type, bug_desc
+            result = self._parse_bug_analysis(content)
+            if self._is_valid_bug_analysis(content):
+                await self._store_analysis(diff_content, result)
+            return result
         except Exception as e:
             print(f"调用AI API失败: {e}")
+            # 失败结果不缓存，后续相同patch重新请求
+            self._analysis_memo.pop(key, None)
             return False, "", ""
 
-    def filter_bug_fixes(
+    async def filter_bug_fixes(
         self,
-        changes: List[Dict],
-        bug_keywords: List[str] = ["Bug", "BUG", "bug"]
+        changes: Union[Iterable[Dict], AsyncIterable[Dict]],
+        bug_keywords: Iterable[str] = ("bug",),
+        offline_batch: bool = False,
+        batch_dir: str = "strict_bugfixes/batch"
     ) -> List[Dict]:
         """
         严格的两步筛选：
         1. 先通过关键词筛选变更
         2. 使用大模型API进行严格的低价值修改判断
+
+        changes可以是列表，也可以是get_project_changes返回的异步流。
+        两步以生产者/消费者流水线运行：生产者下载匹配变更的patch并放入队列，
+        _CONSUMERS个消费者从队列取出patch做AI判断，Gerrit下载与AI调用互相重叠。
+        offline_batch为True时，消费者只做本地检查和缓存查询，未命中的patch在下载完成后
+        统一通过OpenAI Batch API提交(结果24小时内返回，费用约为在线调用的一半)。
         """
-        result = []
-        keyword_pattern = re.compile('|'.join(bug_keywords), re.IGNORECASE)
+        matcher = _KeywordMatcher(bug_keywords)
+        queue = asyncio.Queue(maxsize=_QUEUE_SIZE)
+        # 按匹配顺序记录每个变更的处理状态
+        states = []
+        # 离线批处理模式下等待提交的文件
+        deferred = []
+        # 背压：每个名额对应一个在途的Gerrit请求或一个尚未被消费的patch，
+        # 消费者处理完patch后才归还名额，下载不会跑在AI分析前面太多，也不会挤爆连接池
+        fetch_slots = asyncio.Semaphore(_QUEUE_SIZE)
+
+        async def fetch_change(state: Dict) -> None:
+            change_id = state["change"]["id"]
+            try:
+                async with fetch_slots:
+                    files = await self.get_change_files(change_id)
+            except Exception as e:
+                state["error"] = f"  ⚠️ 获取文件列表时出错: {e}"
+                files = []
+
+            state["entries"] = [None] * len(files)
+            state["pending"] = len(files)
+            if not files:
+                self._finish_change(state, matcher)
+                return
 
-        # 第一步：关键词筛选
-        keyword_matched_changes = [
-            change for change in changes
-            if keyword_pattern.search(change.get("subject", ""))
-        ]
+            async def fetch_file(order: int, file_path: str) -> None:
+                # 名额由消费者在处理完该patch后释放
+                await fetch_slots.acquire()
+                try:
+                    patch = await self.get_well_formatted_patch(change_id, file_path)
+                except Exception as e:
+                    patch = e
+                await queue.put((state, order, file_path, patch))
 
-        print(f"找到 {len(keyword_matched_changes)} 个关键词匹配的变更，开始AI筛选...")
+            await asyncio.gather(*(fetch_file(i, f) for i, f in enumerate(files)))
 
-        # 第二步：使用AI进行严格的低价值修改判断
-        for i, change in enumerate(keyword_matched_changes, 1):
-            change_id = change["id"]
-            files = self.get_change_files(change_id)
-            valuable_files = []
+        async def producer() -> None:
+            # 第一步：关键词筛选，匹配的变更立即开始下载patch，不另建匹配结果列表
+            fetches = []
+            async for change in _matched(changes, matcher):
+                state = {"change": change, "result": None}
+                states.append(state)
+                fetches.append(asyncio.create_task(fetch_change(state)))
+                if len(states) % _PROGRESS_EVERY == 0:
+                    print(f"已匹配 {len(states)} 个变更...")
 
-            print(f"\n处理变更 {i}/{len(keyword_matched_changes)}: {change['subject']}")
+            print(f"找到 {len(states)} 个关键词匹配的变更，等待AI筛选完成...")
 
-            for file_path in files:
+            await asyncio.gather(*fetches)
+            for _ in range(_CONSUMERS):
+                await queue.put(None)
+
+        async def consumer() -> None:
+            # 第二步：使用AI进行严格的低价值修改判断
+            while True:
+                item = await queue.get()
                 try:
-                    patch = self.get_well_formatted_patch(change_id, file_path)
-                    bad_code = self._extract_bad_code(patch)
-                    good_code = self._extract_good_code(patch)
-                    
-                    # 检查 bad_code 和 good_code 是否为空
-                    if not bad_code.strip() or not good_code.strip():
-                        print(f"  ❌ 文件 {file_path} 被识别为低价值变更 (空代码)")
-                        continue
-                    
-                    is_bug, bug_type, bug_desc = self._analyze_bug_with_ai(patch, change["subject"])
-                    
-                    if is_bug:
-                        valuable_files.append({
-                            "path": file_path,
-                            "patch": patch,
-                            "bug_type": bug_type,
-                            "bug_desc": bug_desc,
-                            "bad_code": bad_code,
-                            "good_code": good_code
-                        })
-                        print(f"  ✅ 文件 {file_path} 被识别为有效bug修复")
-                        print(f"    类型: {bug_type}")
-                        print(f"    描述: {bug_desc}")
+                    if item is None:
+                        return
+                    state, order, file_path, patch = item
+                    if offline_batch:
+                        entry = await self._collect_offline(state, order, file_path, patch, deferred)
+                        if entry is None:
+                            continue
                     else:
-                        print(f"  ❌ 文件 {file_path} 被识别为低价值变更")
-                except Exception as e:
-                    print(f"  ⚠️ 处理文件 {file_path} 时出错: {e}")
-                    continue
-
-            if valuable_files:
-                matched_keywords = keyword_pattern.findall(change.get("subject", ""))
-                result.append({
-                    "change_id": change_id,
-                    "number": change["_number"],
-                    "subject": change.get("subject", ""),
-                    "files": valuable_files,
-                    "matched_keywords": list(set(matched_keywords)),
-                    "url": f"http://{self.host}/{change['_number']}"
-                })
-
-        return result
-
-    def _extract_bad_code(self, patch: str) -> str:
-        """从patch中提取被删除的代码(坏代码)"""
-        bad_lines = []
-        for line in patch.split('\n'):
-            if line.startswith('-') and not line.startswith('---'):
-                bad_lines.append(line[1:])
-        return '\n'.join(bad_lines)
+                        entry = await self._analyze_file(state["change"], file_path, patch)
+                    state["entries"][order] = entry
+                    state["pending"] -= 1
+                    if state["pending"] == 0:
+                        self._finish_change(state, matcher)
+                finally:
+                    if item is not None:
+                        fetch_slots.release()
+                    queue.task_done()
+
+        await asyncio.gather(producer(), *(consumer() for _ in range(_CONSUMERS)))
+        if deferred:
+            await self._analyze_files_offline(deferred, batch_dir, matcher)
+        return [state["result"] for state in states if state["result"] is not None]
+
+    async def _collect_offline(self, state: Dict, order: int, file_path: str, patch, deferred: List[Tuple]):
+        """离线批处理模式下处理单个文件：能在本地或缓存中确定结果时直接返回，否则加入deferred并返回None"""
+        try:
+            entry, codes = self._prepare_file(file_path, patch)
+            if entry is not None:
+                return entry
+            subject = state["change"]["subject"]
+            diff = self._compact_diff(*codes)
+            key = self._analysis_key(diff, subject)
+            cached = self._cached_analysis(self._bug_analysis_request(diff, subject))
+            if cached is None:
+                cached = await self._lookup_analysis(diff)
+        except Exception as e:
+            return [f"  ⚠️ 处理文件 {file_path} 时出错: {e}"], None
+
+        if cached is not None:
+            return self._file_entry(file_path, patch, codes[0], codes[1], cached)
+        deferred.append((state, order, file_path, patch, codes, key))
+        return None
+
+    def _prepare_file(self, file_path: str, patch) -> Tuple[Optional[Tuple[List[str], Dict]], Tuple[str, str]]:
+        """
+        AI分析前的本地检查
+        返回: (已确定的文件结果或None, (bad_code, good_code))；结果为None时需要继续AI分析
+        """
+        # patch为下载时的异常对象时直接记录错误
+        if isinstance(patch, Exception):
+            return ([f"  ⚠️ 处理文件 {file_path} 时出错: {patch}"], None), ("", "")
+
+        bad_code, good_code = self._split_patch(patch)
+
+        # 检查 bad_code 和 good_code 是否为空
+        if not bad_code.strip() or not good_code.strip():
+            return ([f"  ❌ 文件 {file_path} 被识别为低价值变更 (空代码)"], None), (bad_code, good_code)
 
-    def _extract_good_code(self, patch: str) -> str:
-        """从patch中提取新增的代码(好代码)"""
+        # 纯空白/注释/import变更无需调用AI
+        if self._is_trivial_diff(bad_code, good_code):
+            return ([f"  ❌ 文件 {file_path} 被识别为低价值变更 (格式/注释/import)"], None), (bad_code, good_code)
+
+        return None, (bad_code, good_code)
+
+    def _file_entry(
+        self,
+        file_path: str,
+        patch: str,
+        bad_code: str,
+        good_code: str,
+        analysis: Tuple[bool, str, str]
+    ) -> Tuple[List[str], Optional[Dict]]:
+        """根据AI分析结果生成文件的(日志行, 有效文件信息或None)"""
+        is_bug, bug_type, bug_desc = analysis
+        if not is_bug:
+            return [f"  ❌ 文件 {file_path} 被识别为低价值变更"], None
+
+        return [
+            f"  ✅ 文件 {file_path} 被识别为有效bug修复",
+            f"    类型: {bug_type}",
+            f"    描述: {bug_desc}"
+        ], {
+            "path": file_path,
+            "patch": patch,
+            "bug_type": bug_type,
+            "bug_desc": bug_desc,
+            "bad_code": bad_code,
+            "good_code": good_code
+        }
+
+    async def _analyze_file(self, change: Dict, file_path: str, patch) -> Tuple[List[str], Optional[Dict]]:
+        """
+        判断单个文件的patch是否为有效bug修复
+        返回: (日志行, 有效文件信息或None)
+        """
+        try:
+            entry, (bad_code, good_code) = self._prepare_file(file_path, patch)
+            if entry is not None:
+                return entry
+            analysis = await self._analyze_bug_with_ai(bad_code, good_code, change["subject"])
+        except Exception as e:
+            return [f"  ⚠️ 处理文件 {file_path} 时出错: {e}"], None
+        return self._file_entry(file_path, patch, bad_code, good_code, analysis)
+
+    async def _analyze_files_offline(self, deferred: List[Tuple], batch_dir: str, matcher: _KeywordMatcher) -> None:
+        """
+        离线批处理模式：把所有未命中缓存的文件打包为一个Batch API任务，
+        结果返回后回填到对应变更
+        """
+        requests = []
+        key_index = {}
+        for state, order, file_path, patch, codes, key in deferred:
+            if key not in key_index:
+                key_index[key] = str(len(requests))
+                diff = self._compact_diff(*codes)
+                requests.append((key_index[key], self._bug_analysis_request(diff, state["change"]["subject"])))
+
+        contents = await run_chat_batch(self.ai_client, requests, batch_dir)
+
+        stored = set()
+        for state, order, file_path, patch, (bad_code, good_code), key in deferred:
+            custom_id = key_index[key]
+            content = contents.get(custom_id)
+            if content is None:
+                entry = [f"  ⚠️ 处理文件 {file_path} 时出错: 离线批处理未返回结果"], None
+            else:
+                analysis = self._parse_bug_analysis(content)
+                if key not in stored and self._is_valid_bug_analysis(content):
+                    # 与在线调用写入同一个响应缓存，键与_chat一致
+                    self.llm_cache.set(make_cache_key(**requests[int(custom_id)][1]), content)
+                    await self._store_analysis(self._compact_diff(bad_code, good_code), analysis)
+                    stored.add(key)
+                entry = self._file_entry(file_path, patch, bad_code, good_code, analysis)
+            state["entries"][order] = entry
+            state["pending"] -= 1
+            if state["pending"] == 0:
+                self._finish_change(state, matcher)
+
+    def _finish_change(self, state: Dict, matcher: _KeywordMatcher) -> None:
+        """变更的所有文件处理完毕后，按文件顺序输出日志并生成结果"""
+        change = state["change"]
+
+        # 输出汇总到变更粒度，避免并发时日志交错
+        logs = [f"\n处理变更: {change['subject']}"]
+        if state.get("error"):
+            logs.append(state["error"])
+        valuable_files = []
+        for file_logs, file_info in state["entries"]:
+            logs.extend(file_logs)
+            if file_info is not None:
+                valuable_files.append(file_info)
+        print("\n".join(logs))
+
+        if valuable_files:
+            state["result"] = {
+                "change_id": change["id"],
+                "number": change["_number"],
+                "subject": change.get("subject", ""),
+                "files": valuable_files,
+                "matched_keywords": matcher.findall(change.get("subject", "")),
+                "url": f"http://{self.host}/{change['_number']}"
+            }
+
+    def _is_trivial_diff(self, bad: str, good: str) -> bool:
+        """
+        本地快速判断非功能性变更，命中时跳过AI分析：
+        1. 只有缩进、行尾空白或空行不同
+        2. 两侧所有非空行都是注释
+        3. 两侧所有非空行都是import/#include
+        """
+        # 逐行去掉首尾空白后比较，保留行结构和行内(包括字符串中)的空白；与_split_patch一样只按换行符切分
+        bad_lines = [line.strip() for line in bad.split('\n') if line.strip()]
+        good_lines = [line.strip() for line in good.split('\n') if line.strip()]
+        if bad_lines == good_lines:
+            return True
+
+        lines = bad_lines + good_lines
+        if all(_COMMENT_LINE_RE.match(line) for line in lines):
+            return True
+        return all(_IMPORT_LINE_RE.match(line) for line in lines)
+
+    def _split_patch(self, patch: str) -> Tuple[str, str]:
+        """单次遍历patch，同时提取被删除的代码(坏代码)和新增的代码(好代码)"""
+        bad_lines = []
         good_lines = []
+        # 只按换行符切分：splitlines还会在\f、\x1c等字符处断行，导致行内剩余部分丢失-/+前缀而被丢弃
         for line in patch.split('\n'):
-            if line.startswith('+') and not line.startswith('+++'):
-                good_lines.append(line[1:])
-        return '\n'.join(good_lines)
+            head = line[:1]
+            if head == '-':
+                if line[:3] != '---':
+                    bad_lines.append(line[1:])
+            elif head == '+':
+                if line[:3] != '+++':
+                    good_lines.append(line[1:])
+        return '\n'.join(bad_lines), '\n'.join(good_lines)
 
-    def download_bugfix_patches(
+    async def download_bugfix_patches(
         self,
         project_name: str,
         output_dir: str = "strict_bugfixes",
         bug_keywords: List[str] = None,
-        max_retries: int = 3
+        max_retries: int = 3,
+        offline_batch: bool = False
     ):
-        """严格模式下载Bug修复patch"""
+        """严格模式下载Bug修复patch，offline_batch为True时AI判断走OpenAI Batch API"""
         os.makedirs(output_dir, exist_ok=True)
+        if self.config.get("semantic_cache", False):
+            try:
+                self.semantic_cache = SemanticCache(
+                    os.path.join(output_dir, ".semantic_cache"),
+                    threshold=self.config.get("semantic_cache_threshold", 0.95)
+                )
+            except ImportError as e:
+                print(f"⚠️ 语义缓存依赖缺失，已关闭语义缓存: {e}")
         
         if bug_keywords is None:
-            bug_keywords = ["Bug", "BUG", "bug", "错误", "修复"]
+            bug_keywords = _DEFAULT_KWS
 
         print(f"严格模式扫描项目 {project_name}...")
         print("筛选流程: 1.关键词匹配 → 2.AI判断是否为真实bug修复")
         changes = self.get_project_changes(project_name)
-        bugfix_changes = self.filter_bug_fixes(changes, bug_keywords)
+        try:
+            bugfix_changes = await self.filter_bug_fixes(
+                changes, bug_keywords,
+                offline_batch=offline_batch,
+                batch_dir=os.path.join(output_dir, "batch")
+            )
+        finally:
+            # 中途出错时也保留本次已写入的语义缓存
+            if self.semantic_cache is not None:
+                self.semantic_cache.save()
         
         print(f"\n找到 {len(bugfix_changes)} 个有效Bug修复变更:")
         
@@ -297,14 +751,43 @@ class GerritClient:
         print(f"\n严格模式完成！有效patch保存在: {os.path.abspath(output_dir)}")
 
 
-if __name__ == "__main__":
+async def _aiter(items: Union[Iterable, AsyncIterable]) -> AsyncIterator:
+    """统一遍历同步/异步可迭代对象"""
+    if hasattr(items, '__aiter__'):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
+
+
+async def _matched(changes: Union[Iterable[Dict], AsyncIterable[Dict]], matcher: _KeywordMatcher) -> AsyncIterator[Dict]:
+    """逐个产出subject命中关键词的变更"""
+    async for change in _aiter(changes):
+        if matcher.search(change.get("subject", "")):
+            yield change
+
+
+async def main(offline_batch: bool = False):
     # 加载配置文件
     config_path = "gerrit_AI_config.yaml"  # 或者使用绝对路径
     
     client = GerritClient(config_path)
     
-    # 执行严格模式下载
-    client.download_bugfix_patches(
-        project_name=client.config['project_name'],
-        bug_keywords=["Bug", "BUG", "bug"]
-    )
\ No newline at end of file
+    try:
+        # 执行严格模式下载
+        await client.download_bugfix_patches(
+            project_name=client.config['project_name'],
+            bug_keywords=["Bug", "BUG", "bug"],
+            offline_batch=offline_batch
+        )
+    finally:
+        await client.aclose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="严格模式下载Gerrit上的Bug修复patch")
+    parser.add_argument("--offline-batch", action="store_true",
+                        help="通过OpenAI Batch API离线提交AI判断(24小时内返回，费用减半)")
+    args = parser.parse_args()
+    asyncio.run(main(offline_batch=args.offline_batch))
\ No newline at end of file
@@ -1,18 +1,172 @@
 from typing import *
-import json
+import argparse
+import asyncio
+import hashlib
 from urllib.parse import urlparse, quote
 import os
+import shutil
+import tempfile
+from contextlib import asynccontextmanager
 from pathlib import Path
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+import orjson
+import ijson
 from utils.log import logger
 from utils.misc import load_yaml
 from utils.gitlab_api import GitLabAPI
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import product
+
+try:
+    import aiohttp
+except ImportError:  # 未安装aiohttp时用线程池获取diff
+    aiohttp = None
+
+try:
+    import brotli
+except ImportError:  # 未安装brotli时只请求gzip/deflate压缩
+    brotli = None
+
+try:
+    import aiofiles
+except ImportError:  # 未安装aiofiles时在线程中写文件
+    aiofiles = None
+
+# 并发获取commit diff的上限
+_DIFF_CONCURRENCY = 16
+# 所有commit合计同时写入的diff文件数上限
+_WRITE_CONCURRENCY = 16
+# 获取diff遇到这些状态码时按指数退避重试
+_RETRY_STATUS = (429, 500, 502, 503, 504)
+_RETRY_TOTAL = 3
+_RETRY_BACKOFF = 0.3
+# (new_file, deleted_file, renamed_file) -> 变更类型，多个标记同时为真时按 新增>删除>重命名 取值
+_CHANGE_MAP = {
+    flags: "added" if flags[0] else "deleted" if flags[1] else "renamed" if flags[2] else "modified"
+    for flags in product((False, True), repeat=3)
+}
+# 请求GitLab压缩响应体，diff文本通常可压缩5~10倍；requests/aiohttp会自动解压
+_ACCEPT_ENCODING = "gzip, deflate, br" if brotli is not None else "gzip, deflate"
+# 报告输出根目录，以及跨运行保存的 commit_id -> ETag 记录
+_REPORT_ROOT = "diff_reports"
+_ETAG_STORE = os.path.join(_REPORT_ROOT, ".etags.json")
+# 所有commit的差异报告追加写入同一个JSONL文件，索引记录 commit_id -> [偏移, 长度, 报告内容哈希]
+_REPORT_JSONL = os.path.join(_REPORT_ROOT, "all.jsonl")
+_REPORT_INDEX = os.path.join(_REPORT_ROOT, ".all_index.json")
+# diff文件名中需替换为"_"的字符(路径分隔符及Windows非法字符)，单次translate完成
+_SAFE_NAME_TABLE = str.maketrans({c: '_' for c in '/\\:*?"<>|'})
+# 报告/diff文件的写缓冲大小，整份内容尽量一次系统调用写完
+_WRITE_BUFFER = 1 << 20
+
+
+def _dump_json(data: Any, pretty: bool = False) -> bytes:
+    """序列化为UTF-8编码的JSON，默认紧凑格式，pretty为True时缩进便于人工查看"""
+    return orjson.dumps(data, option=orjson.OPT_INDENT_2 if pretty else 0)
+
+
+def _load_json(content: bytes) -> Any:
+    """解析UTF-8编码的JSON响应体"""
+    return orjson.loads(content)
+
+
+def _write_file(path: str, *chunks: bytes) -> None:
+    with open(path, 'wb', buffering=_WRITE_BUFFER) as f:
+        for chunk in chunks:
+            f.write(chunk)
+
+
+async def _write_bytes(path: str, *chunks: bytes) -> None:
+    """异步依次写入各段内容组成整个文件，不阻塞事件循环"""
+    if aiofiles is not None:
+        async with aiofiles.open(path, 'wb', buffering=_WRITE_BUFFER) as f:
+            for chunk in chunks:
+                await f.write(chunk)
+    else:
+        await asyncio.to_thread(_write_file, path, *chunks)
+
+
+async def _write_limited(sem: asyncio.Semaphore, path: str, *chunks: bytes) -> None:
+    """占用一个写入名额后写文件，避免大commit同时打开过多文件句柄/线程"""
+    async with sem:
+        await _write_bytes(path, *chunks)
+
+
+def _diff_file(out_prefix: str, diff: dict) -> Optional[Tuple[str, bytes, bytes]]:
+    """根据一个diff条目得到(输出文件路径, 文件头, 正文)，没有文件路径的条目返回None"""
+    old_path = diff.get('old_path', '')
+    new_path = diff.get('new_path', '')
+    filename = new_path if new_path else old_path
+    if not filename:
+        return None
+    # 创建安全文件名
+    output_file = f"{out_prefix}{filename.translate(_SAFE_NAME_TABLE)}.diff"
+    # 文件头与正文分别编码后写入，不再拼接出整份diff的中间字符串；diff为null时(如二进制文件)写入空正文
+    diff_content = diff.get('diff') or ''
+    header = f"--- {old_path}\n+++ {new_path}\n".encode('utf-8')
+    body = diff_content.encode('utf-8') if isinstance(diff_content, str) else diff_content
+    return output_file, header, body
+
+
+async def _iter_diffs(saved: Optional[List[dict]], response) -> AsyncIterator[dict]:
+    """逐个产出304命中时保存的diff条目，或边下载边解析响应中的diff条目"""
+    if saved is not None:
+        for diff in saved:
+            yield diff
+        return
+    # use_float=True: 数字解析为float而不是Decimal，orjson可以直接序列化
+    async for diff in ijson.items_async(response.content, 'item', use_float=True):
+        yield diff
+
+
+class _ReportStream:
+    """
+    逐个diff写入单个commit的报告行 {"commit_id":..,"diffs":[..],"files":[..],"timestamp":..}
+    内容先写入临时文件(不超过_WRITE_BUFFER时留在内存)并同步计算哈希，最后整体追加到报告JSONL，
+    并发处理的多个commit不会在JSONL中交错；diff正文只在diffs中保存一份，files只记录路径和变更类型
+    """
+
+    def __init__(self, commit_id: str):
+        self._spool = tempfile.SpooledTemporaryFile(max_size=_WRITE_BUFFER)
+        self._hash = hashlib.sha256()
+        self.size = 0
+        self.files: List[dict] = []
+        self._write(b'{"commit_id":' + _dump_json(commit_id) + b',"diffs":[')
+
+    def _write(self, chunk: bytes) -> None:
+        self._spool.write(chunk)
+        self._hash.update(chunk)
+        self.size += len(chunk)
+
+    def add(self, diff: dict) -> dict:
+        """写入一个diff条目，返回它在files中的记录"""
+        self._write(b',' + _dump_json(diff) if self.files else _dump_json(diff))
+        flags = (bool(diff.get('new_file')), bool(diff.get('deleted_file')), bool(diff.get('renamed_file')))
+        entry = {
+            "old_path": diff.get('old_path'),
+            "new_path": diff.get('new_path'),
+            "change_type": _CHANGE_MAP[flags]
+        }
+        self.files.append(entry)
+        return entry
+
+    def finish(self) -> str:
+        """写入files列表，返回报告内容(不含时间戳)的sha256"""
+        self._write(b'],"files":' + _dump_json(self.files))
+        return self._hash.hexdigest()
+
+    def copy_to(self, f) -> None:
+        self._spool.seek(0)
+        shutil.copyfileobj(self._spool, f, _WRITE_BUFFER)
+
+    def close(self) -> None:
+        self._spool.close()
 
-logger.info('成功导入日志模块')
 
 class GitLabCommitAnalyzer:
-    def __init__(self, config=None):
+    def __init__(self, config=None, pretty: bool = False):
         # 加载配置
         if config is None:
             self.config = load_yaml("configs/env.yaml")
@@ -25,18 +179,48 @@ class GitLabCommitAnalyzer:
 
         # 统一API根路径
         self.api_root = f"http://{self.config['GITLAB']['HOST']}/api/v4"
-        logger.debug(f"API根路径: {self.api_root}")
+        logger.opt(lazy=True).debug("API根路径: {}", lambda: self.api_root)
 
         # 初始化Session
         self._s = requests.Session()
         self._s.headers.update({
             "PRIVATE-TOKEN": self.config['GITLAB']['TOKEN'],
-            "Content-Type": "application/json"
+            "Content-Type": "application/json",
+            "Accept-Encoding": _ACCEPT_ENCODING
         })
         self._s.verify = False  # 忽略SSL验证（仅测试环境）
+        # prefetch_commit_diffs以_DIFF_CONCURRENCY个线程共用该Session，连接池需容纳全部线程才能复用keep-alive连接
+        adapter = HTTPAdapter(
+            pool_connections=16,
+            pool_maxsize=_DIFF_CONCURRENCY,
+            max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504])
+        )
+        self._s.mount('http://', adapter)
+        self._s.mount('https://', adapter)
 
         # 初始化API客户端
         self.api = GitLabAPI(self.api_root, self.config['GITLAB']['TOKEN'])
+
+        # 是否额外输出缩进的单独报告(调试用)
+        self.pretty = pretty
+
+        # commit_id -> 差异数据，同一commit的diff只请求一次
+        self._diff_cache: Dict[str, List[dict]] = {}
+
+        # 上次运行记录的ETag，请求时带上If-None-Match，未变化的commit由服务端返回304
+        self._etags: Dict[str, str] = {}
+        if os.path.exists(_ETAG_STORE):
+            with open(_ETAG_STORE, 'rb') as f:
+                self._etags = _load_json(f.read())
+
+        # 报告JSONL的行索引与写句柄(首次写入时打开)
+        self._report_index: Dict[str, list] = {}
+        if os.path.exists(_REPORT_INDEX) and os.path.exists(_REPORT_JSONL):
+            with open(_REPORT_INDEX, 'rb') as f:
+                self._report_index = _load_json(f.read())
+        self._report_writer = None
+        # 本次运行中由304命中、报告无需重写的commit
+        self._unchanged = set()
         
     def extract_project_path(self, url: str) -> str:
         """从URL提取项目路径"""
@@ -47,7 +231,7 @@ class GitLabCommitAnalyzer:
     def get_project_id(self, project_url: str) -> int:
         """获取数字项目ID"""
         project_path = self.extract_project_path(project_url)
-        logger.debug(f"提取的项目路径: {project_path}")
+        logger.opt(lazy=True).debug("提取的项目路径: {}", lambda: project_path)
         return self.api.get_project_id(project_path)
 
     def initialize_project(self, target: dict) -> None:
@@ -65,30 +249,207 @@ class GitLabCommitAnalyzer:
                 f"?ref_name={quote(self.ref, safe='')}&per_page={limit}"
             )
             
-            logger.debug(f"请求端点: {endpoint}")
+            logger.opt(lazy=True).debug("请求端点: {}", lambda: endpoint)
             response = self._s.get(endpoint)
             
             if 'application/json' not in response.headers.get('Content-Type', ''):
                 raise ValueError(f"响应不是JSON: {response.text[:200]}...")
                 
-            return response.json()
+            return _load_json(response.content)
         except Exception as e:
             logger.error(f"获取提交失败: {str(e)}")
             raise
     
     def get_commit_diff(self, commit_id: str) -> List[dict]:
-        """获取commit差异数据"""
+        """获取commit差异数据(按commit_id缓存)"""
+        cached = self._diff_cache.get(commit_id)
+        if cached is not None:
+            return cached
+        endpoint = f"{self.api_root}/projects/{self.project_id}/repository/commits/{commit_id}/diff"
+        etag = self._etags.get(commit_id)
+        response = self._s.get(endpoint, headers={"If-None-Match": etag} if etag else None)
+        if response.status_code == 304:
+            diffs = self._load_saved_diffs(commit_id)
+            if diffs is None:
+                # 本地报告已不存在，重新完整请求
+                diffs = self._read_diff_response(commit_id, self._s.get(endpoint))
+        else:
+            diffs = self._read_diff_response(commit_id, response)
+        self._diff_cache[commit_id] = diffs
+        return diffs
+
+    def _read_diff_response(self, commit_id: str, response) -> List[dict]:
+        """校验状态码并解析diff响应，同时记录ETag"""
+        response.raise_for_status()
+        # 直接从bytes解析，省去先解码为str的一份拷贝
+        diffs = _load_json(response.content)
+        self._remember_etag(commit_id, response.headers.get('ETag'))
+        return diffs
+
+    def _load_saved_diffs(self, commit_id: str) -> Optional[List[dict]]:
+        """按索引偏移从报告JSONL中读取之前保存的diff数据，报告不存在时返回None"""
+        entry = self._report_index.get(commit_id)
+        if entry is None:
+            return None
+        if self._report_writer is not None:
+            self._report_writer.flush()
+        offset, length = entry[0], entry[1]
+        with open(_REPORT_JSONL, 'rb') as f:
+            f.seek(offset)
+            line = f.read(length)
+        if len(line) != length:
+            return None
+        self._unchanged.add(commit_id)
+        return _load_json(line).get("diffs")
+
+    def _remember_etag(self, commit_id: str, etag: Optional[str]) -> None:
+        if etag:
+            self._etags[commit_id] = etag
+
+    def _append_report(self, commit_id: str, report: _ReportStream, timestamp: str) -> int:
+        """
+        把一条报告追加到JSONL，返回该行的起始偏移；
+        该commit已有内容相同的报告时不再追加，直接返回已有行的偏移，避免重复请求时文件无限增长
+        """
+        # 哈希取自已写入临时文件的字节，时间戳拼在末尾，不影响哈希
+        digest = report.finish()
+        entry = self._report_index.get(commit_id)
+        if entry is not None and len(entry) > 2 and entry[2] == digest:
+            return entry[0]
+        if self._report_writer is None:
+            Path(_REPORT_ROOT).mkdir(parents=True, exist_ok=True)
+            self._report_writer = open(_REPORT_JSONL, 'ab', buffering=_WRITE_BUFFER)
+        offset = self._report_writer.tell()
+        report.copy_to(self._report_writer)
+        tail = b',"timestamp":' + _dump_json(timestamp) + b'}'
+        self._report_writer.write(tail + b"\n")
+        self._report_index[commit_id] = [offset, report.size + len(tail), digest]
+        return offset
+
+    def _save_report(
+        self,
+        result: dict,
+        report: _ReportStream,
+        timestamp: str,
+        output_dir: str,
+        diffs: Optional[List[dict]]
+    ) -> None:
+        """保存报告并填写result：304命中的commit沿用JSONL中已有的那一行；pretty模式下用diffs额外写一份缩进的单独报告"""
+        commit_id = result["commit_id"]
+        if commit_id in self._unchanged and commit_id in self._report_index:
+            result["report_offset"] = self._report_index[commit_id][0]
+        else:
+            result["report_offset"] = self._append_report(commit_id, report, timestamp)
+        result["report_path"] = os.path.abspath(_REPORT_JSONL)
+        logger.info(f"差异报告已写入: {_REPORT_JSONL} (偏移 {result['report_offset']})")
+
+        if self.pretty:
+            Path(output_dir).mkdir(parents=True, exist_ok=True)
+            report_data = {"commit_id": commit_id, "diffs": diffs, "files": report.files, "timestamp": timestamp}
+            report_file = Path(output_dir) / f"diff_report_{commit_id[:8]}.json"
+            with open(report_file, 'wb', buffering=_WRITE_BUFFER) as f:
+                f.write(_dump_json(report_data, True))
+
+    def close(self) -> None:
+        """落盘报告JSONL，并持久化行索引和ETag记录，供下次运行发送条件请求"""
+        if self._report_writer is not None:
+            self._report_writer.close()
+            self._report_writer = None
+        Path(_REPORT_ROOT).mkdir(parents=True, exist_ok=True)
+        with open(_REPORT_INDEX, 'wb') as f:
+            f.write(_dump_json(self._report_index))
+        with open(_ETAG_STORE, 'wb') as f:
+            f.write(_dump_json(self._etags))
+
+    @asynccontextmanager
+    async def _open_commit_diff(self, session, commit_id: str):
+        """
+        异步请求单个commit的差异数据，带上ETag条件头，429/5xx时按指数退避重试
+        产出(之前保存的diff列表, None)或(None, 未读取正文的响应)；正文处理成功后才记录新的ETag
+        """
         endpoint = f"{self.api_root}/projects/{self.project_id}/repository/commits/{commit_id}/diff"
-        return self._s.get(endpoint).json()
+        etag = self._etags.get(commit_id)
+        for attempt in range(_RETRY_TOTAL + 1):
+            headers = {"If-None-Match": etag} if etag else None
+            async with session.get(endpoint, headers=headers) as response:
+                if response.status == 304:
+                    diffs = self._load_saved_diffs(commit_id)
+                    if diffs is not None:
+                        yield diffs, None
+                        return
+                    # 本地报告已不存在，去掉条件头重新请求
+                    etag = None
+                    continue
+                if response.status in _RETRY_STATUS and attempt < _RETRY_TOTAL:
+                    await asyncio.sleep(_RETRY_BACKOFF * (2 ** attempt))
+                    continue
+                response.raise_for_status()
+                yield None, response
+                self._remember_etag(commit_id, response.headers.get('ETag'))
+                return
+        raise RuntimeError(f"重试{_RETRY_TOTAL}次后仍未获取到diff")
+
+    async def fetch_commit_diff(self, session, sem: asyncio.Semaphore, commit_id: str) -> Tuple[str, Any]:
+        """
+        异步获取单个commit的差异数据，429/5xx时按指数退避重试
+        返回: (commit_id, 差异数据或异常对象)
+        """
+        async with sem:
+            try:
+                async with self._open_commit_diff(session, commit_id) as (saved, response):
+                    diffs = saved if saved is not None else _load_json(await response.read())
+                return commit_id, diffs
+            except Exception as e:
+                return commit_id, e
+
+    def client_session(self):
+        """创建获取diff用的aiohttp会话，连接数与_DIFF_CONCURRENCY一致"""
+        connector = aiohttp.TCPConnector(limit_per_host=_DIFF_CONCURRENCY, ssl=False)
+        headers = {"PRIVATE-TOKEN": self.config['GITLAB']['TOKEN'], "Accept-Encoding": _ACCEPT_ENCODING}
+        return aiohttp.ClientSession(headers=headers, connector=connector)
+
+    async def gather_commit_diffs(self, commit_ids: List[str]) -> Dict[str, Any]:
+        """并发获取多个commit的差异数据，返回 commit_id -> 差异数据或异常对象"""
+        sem = asyncio.Semaphore(_DIFF_CONCURRENCY)
+        async with self.client_session() as session:
+            results = await asyncio.gather(
+                *(self.fetch_commit_diff(session, sem, commit_id) for commit_id in commit_ids)
+            )
+        return dict(results)
+
+    def prefetch_commit_diffs(self, commit_ids: List[str]) -> Dict[str, Any]:
+        """一次性获取所有commit的差异数据，供generate_diff_report/save_raw_diff_files复用"""
+        results = {commit_id: self._diff_cache[commit_id] for commit_id in commit_ids if commit_id in self._diff_cache}
+        missing = [commit_id for commit_id in commit_ids if commit_id not in results]
+
+        if aiohttp is not None:
+            if missing:
+                results.update(asyncio.run(self.gather_commit_diffs(missing)))
+                for commit_id in missing:
+                    if not isinstance(results[commit_id], Exception):
+                        self._diff_cache[commit_id] = results[commit_id]
+            return results
+
+        # 未安装aiohttp时用线程池并发请求，共享的requests.Session可在线程间复用
+        with ThreadPoolExecutor(max_workers=_DIFF_CONCURRENCY) as executor:
+            futures = {executor.submit(self.get_commit_diff, commit_id): commit_id for commit_id in missing}
+            for future in as_completed(futures):
+                try:
+                    results[futures[future]] = future.result()
+                except Exception as e:
+                    results[futures[future]] = e
+        return results
     
-    def generate_diff_report(self, commit_id: str, output_dir: str = "diff_reports") -> dict:
+    def generate_diff_report(self, commit_id: str, output_dir: str = "diff_reports", diffs: Optional[List[dict]] = None) -> dict:
         """
-        生成完整的差异报告并保存到文件
+        生成完整的差异报告并追加到报告JSONL，diffs为已获取的差异数据，未传入时自动请求；
+        pretty模式下额外在output_dir写一份缩进的单独报告
         返回结构:
         {
             "status": "success"|"error",
             "commit_id": str,
-            "report_path": str,
+            "report_path": str,  # 报告JSONL的绝对路径
+            "report_offset": int,  # 报告在JSONL中所在行的起始偏移
             "files_changed": List[str],
             "error": Optional[str]
         }
@@ -97,47 +458,29 @@ class GitLabCommitAnalyzer:
             "status": "success",
             "commit_id": commit_id,
             "report_path": "",
+            "report_offset": -1,
             "files_changed": [],
             "error": None
         }
 
         try:
-            # 确保输出目录存在
-            Path(output_dir).mkdir(parents=True, exist_ok=True)
-            
             # 获取差异数据
-            diffs = self.get_commit_diff(commit_id)
+            if diffs is None:
+                diffs = self.get_commit_diff(commit_id)
             if not diffs:
                 raise ValueError("没有找到差异数据")
             
-            # 创建报告文件
-            report_file = Path(output_dir) / f"diff_report_{commit_id[:8]}.json"
-            report_data = {
-                "commit_id": commit_id,
-                "timestamp": str(datetime.now()),
-                "diffs": diffs,
-                "files": []
-            }
-
-            # 处理每个文件的差异
-            for diff in diffs:
-                file_info = {
-                    "old_path": diff.get('old_path'),
-                    "new_path": diff.get('new_path'),
-                    "change_type": "added" if diff.get('new_file') else 
-                                 "deleted" if diff.get('deleted_file') else 
-                                 "renamed" if diff.get('renamed_file') else "modified",
-                    "diff": diff.get('diff', '')
-                }
-                report_data["files"].append(file_info)
-                result["files_changed"].append(file_info["new_path"] or file_info["old_path"])
-
-            # 保存报告
-            with open(report_file, 'w', encoding='utf-8') as f:
-                json.dump(report_data, f, indent=2, ensure_ascii=False)
-            
-            result["report_path"] = str(report_file.absolute())
-            logger.info(f"差异报告已保存到: {result['report_path']}")
+            timestamp = str(datetime.now())
+            report = _ReportStream(commit_id)
+            try:
+                # 处理每个文件的差异
+                files_changed = result["files_changed"]
+                for diff in diffs:
+                    entry = report.add(diff)
+                    files_changed.append(entry["new_path"] or entry["old_path"])
+                self._save_report(result, report, timestamp, output_dir, diffs)
+            finally:
+                report.close()
             return result
 
         except Exception as e:
@@ -148,9 +491,17 @@ class GitLabCommitAnalyzer:
             })
             return result
 
-    def save_raw_diff_files(self, commit_id: str, output_dir: str = "raw_diffs") -> dict:
+    async def save_raw_diff_files(
+        self,
+        commit_id: str,
+        output_dir: str = "raw_diffs",
+        diffs: Optional[List[dict]] = None,
+        write_sem: Optional[asyncio.Semaphore] = None
+    ) -> dict:
         """
-        保存原始diff文件到指定目录
+        保存原始diff文件到指定目录，diffs为已获取的差异数据，未传入时自动请求
+        各文件并发写入，write_sem限制同时写入的文件数，多个commit并发保存时传入同一个信号量；
+        未传入时每次调用单独创建，信号量只在当前事件循环中使用
         返回结构:
         {
             "status": "success"|"error",
@@ -170,33 +521,33 @@ class GitLabCommitAnalyzer:
 
         try:
             # 获取差异数据
-            diffs = self.get_commit_diff(commit_id)
+            if diffs is None:
+                diffs = self.get_commit_diff(commit_id)
             
             # 确保输出目录存在
             Path(output_dir).mkdir(parents=True, exist_ok=True)
             
+            # 循环外准备好输出路径前缀，每个文件只做字符串拼接
+            out_prefix = os.path.join(output_dir, "")
+            saved_files = result["saved_files"]
+            
             # 保存每个文件的diff
+            # 不同路径可能映射为同一安全文件名(如a/b_c与a_b/c)，与顺序写入时一样只保留最后一份
+            writes: Dict[str, Tuple[bytes, bytes]] = {}
             for diff in diffs:
-                old_path = diff.get('old_path', '')
-                new_path = diff.get('new_path', '')
-                diff_content = diff.get('diff', '')
-                
-                # 确定文件名
-                filename = new_path if new_path else old_path
-                if not filename:
+                file = _diff_file(out_prefix, diff)
+                if file is None:
                     continue
-                    
-                # 创建安全文件名
-                safe_name = filename.replace('/', '_')
-                output_file = Path(output_dir) / f"{safe_name}.diff"
-                
-                # 写入diff内容
-                with open(output_file, 'w', encoding='utf-8') as f:
-                    f.write(f"--- {old_path}\n+++ {new_path}\n{diff_content}")
-                
-                result["saved_files"].append(str(output_file))
+                output_file, header, body = file
+                writes[output_file] = (header, body)
+                saved_files.append(output_file)
             
-            logger.info(f"已保存 {len(result['saved_files'])} 个差异文件到 {output_dir}")
+            if write_sem is None:
+                write_sem = asyncio.Semaphore(_WRITE_CONCURRENCY)
+            await asyncio.gather(*(
+                _write_limited(write_sem, path, *chunks) for path, chunks in writes.items()
+            ))
+            logger.info(f"已保存 {len(saved_files)} 个差异文件到 {output_dir}")
             return result
 
         except Exception as e:
@@ -207,64 +558,209 @@ class GitLabCommitAnalyzer:
             })
             return result
 
-def main():
+    async def stream_commit(
+        self,
+        session,
+        sem: asyncio.Semaphore,
+        write_sem: asyncio.Semaphore,
+        commit_id: str,
+        output_dir: str
+    ) -> dict:
+        """
+        边下载边处理单个commit：每解析出一个diff条目，就写出对应的原始diff文件并写入报告，
+        不在内存中保留整个commit的diff列表(pretty模式需要完整列表写缩进报告时除外)
+        sem限制同时下载的commit数，write_sem限制同时写入的diff文件数
+        返回结构:
+        {
+            "status": "success"|"error",
+            "commit_id": str,
+            "report_path": str,
+            "report_offset": int,
+            "files_changed": List[str],
+            "output_dir": str,
+            "saved_files": List[str],
+            "error": Optional[str]
+        }
+        """
+        result = {
+            "status": "success",
+            "commit_id": commit_id,
+            "report_path": "",
+            "report_offset": -1,
+            "files_changed": [],
+            "output_dir": os.path.abspath(output_dir),
+            "saved_files": [],
+            "error": None
+        }
+        report = _ReportStream(commit_id)
+        kept = [] if self.pretty else None
+
+        try:
+            timestamp = str(datetime.now())
+            Path(output_dir).mkdir(parents=True, exist_ok=True)
+            out_prefix = os.path.join(output_dir, "")
+            files_changed = result["files_changed"]
+            saved_files = result["saved_files"]
+
+            async with sem:
+                async with self._open_commit_diff(session, commit_id) as (saved, response):
+                    async for diff in _iter_diffs(saved, response):
+                        entry = report.add(diff)
+                        files_changed.append(entry["new_path"] or entry["old_path"])
+                        file = _diff_file(out_prefix, diff)
+                        if file is not None:
+                            # 同一commit内按顺序写入，安全文件名冲突时与save_raw_diff_files一样保留最后一份
+                            await _write_limited(write_sem, *file)
+                            saved_files.append(file[0])
+                        if kept is not None:
+                            kept.append(diff)
+            if not files_changed:
+                raise ValueError("没有找到差异数据")
+
+            self._save_report(result, report, timestamp, output_dir, kept)
+            logger.info(f"已保存 {len(saved_files)} 个差异文件到 {output_dir}")
+            return result
+
+        except Exception as e:
+            logger.error(f"流式处理commit差异失败: {str(e)}")
+            result.update({
+                "status": "error",
+                "error": str(e)
+            })
+            return result
+        finally:
+            report.close()
+
+
+async def process_commit(
+    analyzer: GitLabCommitAnalyzer,
+    commit: dict,
+    diffs: Any,
+    write_sem: Optional[asyncio.Semaphore] = None
+) -> int:
+    """生成单个commit的差异报告并保存diff文件，返回修改文件数，失败时抛出异常"""
+    commit_id = commit['id']
+    commit_msg = commit['message'].strip()
+    logger.info(f"正在处理 commit: {commit_id[:8]} - {commit_msg}")
+    
+    if isinstance(diffs, Exception):
+        raise RuntimeError(f"获取差异数据失败: {diffs}")
+    
+    # 为每个commit创建独立目录
+    commit_output_dir = os.path.join(_REPORT_ROOT, f"commit_{commit_id[:8]}")
+    
+    # 生成差异报告
+    report_result = analyzer.generate_diff_report(commit_id, commit_output_dir, diffs)
+    if report_result["status"] != "success":
+        raise RuntimeError(f"生成报告失败: {report_result['error']}")
+    
+    # 保存原始diff文件
+    diff_result = await analyzer.save_raw_diff_files(commit_id, commit_output_dir, diffs, write_sem)
+    if diff_result["status"] != "success":
+        raise RuntimeError(f"保存diff文件失败: {diff_result['error']}")
+    
+    files_changed = len(diff_result["saved_files"])
+    print(f"Commit {commit_id[:8]} 处理完成, 修改文件数: {files_changed}")
+    return files_changed
+
+
+async def stream_process_commit(
+    analyzer: GitLabCommitAnalyzer,
+    session,
+    sem: asyncio.Semaphore,
+    commit: dict,
+    write_sem: asyncio.Semaphore
+) -> int:
+    """边下载边生成单个commit的差异报告和diff文件，返回修改文件数，失败时抛出异常"""
+    commit_id = commit['id']
+    commit_msg = commit['message'].strip()
+    logger.info(f"正在处理 commit: {commit_id[:8]} - {commit_msg}")
+
+    # 为每个commit创建独立目录
+    commit_output_dir = os.path.join(_REPORT_ROOT, f"commit_{commit_id[:8]}")
+
+    result = await analyzer.stream_commit(session, sem, write_sem, commit_id, commit_output_dir)
+    if result["status"] != "success":
+        raise RuntimeError(f"处理差异数据失败: {result['error']}")
+
+    files_changed = len(result["saved_files"])
+    print(f"Commit {commit_id[:8]} 处理完成, 修改文件数: {files_changed}")
+    return files_changed
+
+
+async def process_commits(
+    analyzer: GitLabCommitAnalyzer,
+    commits: List[dict],
+    all_diffs: Optional[Dict[str, Any]] = None
+) -> Tuple[int, int, List[dict]]:
+    """
+    并发处理所有commit：传入all_diffs时使用已获取的差异数据，
+    否则通过aiohttp边下载边处理，每个diff条目解析出来就写出
+    返回: (成功处理的commit数, 累计修改文件数, 失败的commit列表)
+    """
+    # 所有commit共用一个写入名额池，在本事件循环内创建
+    write_sem = asyncio.Semaphore(_WRITE_CONCURRENCY)
+    if all_diffs is None:
+        sem = asyncio.Semaphore(_DIFF_CONCURRENCY)
+        async with analyzer.client_session() as session:
+            results = await asyncio.gather(
+                *(stream_process_commit(analyzer, session, sem, commit, write_sem) for commit in commits),
+                return_exceptions=True
+            )
+    else:
+        results = await asyncio.gather(
+            *(process_commit(analyzer, commit, all_diffs[commit['id']], write_sem) for commit in commits),
+            return_exceptions=True
+        )
+    
+    total_commits_processed = 0
+    total_files_changed = 0
+    failed_commits = []
+    for commit, result in zip(commits, results):
+        if isinstance(result, Exception):
+            logger.error(f"处理commit {commit['id'][:8]} 时出错: {str(result)}")
+            failed_commits.append({
+                "commit_id": commit['id'],
+                "error": str(result)
+            })
+            continue
+        total_files_changed += result
+        total_commits_processed += 1
+    return total_commits_processed, total_files_changed, failed_commits
+
+
+def main(pretty: bool = False):
     try:
         # 加载配置
         config = load_yaml("configs/env.yaml")
         
         # 初始化分析器
-        analyzer = GitLabCommitAnalyzer(config)
-        analyzer.initialize_project(config["PROJECT"])
+        analyzer = GitLabCommitAnalyzer(config, pretty=pretty)
+        # 中途出错或提前返回时也落盘已写出的报告、行索引和ETag记录
+        try:
+            analyzer.initialize_project(config["PROJECT"])
         
-        # 获取最近的100条commits
-        commits = analyzer.get_commits(limit=10)
-        if not commits:
-            logger.error("没有找到任何commits")
-            return
+            # 获取最近的100条commits
+            commits = analyzer.get_commits(limit=10)
+            if not commits:
+                logger.error("没有找到任何commits")
+                return
         
-        total_commits_processed = 0
-        total_files_changed = 0
-        failed_commits = []
+            print("\n" + "="*50)
+            print(f"开始分析 {len(commits)} 条commits的差异")
+            print("="*50 + "\n")
         
-        print("\n" + "="*50)
-        print(f"开始分析 {len(commits)} 条commits的差异")
-        print("="*50 + "\n")
+            # 有aiohttp时边下载边写出报告与diff文件；否则先用线程池获取所有commit的差异数据，报告与diff文件共用
+            all_diffs = None
+            if aiohttp is None:
+                all_diffs = analyzer.prefetch_commit_diffs([commit['id'] for commit in commits])
         
-        # 处理每条commit
-        for commit in commits:
-            commit_id = commit['id']
-            commit_msg = commit['message'].strip()
-            
-            try:
-                logger.info(f"正在处理 commit: {commit_id[:8]} - {commit_msg}")
-                
-                # 为每个commit创建独立目录
-                commit_output_dir = f"diff_reports/commit_{commit_id[:8]}"
-                
-                # 生成差异报告
-                report_result = analyzer.generate_diff_report(commit_id, commit_output_dir)
-                if report_result["status"] != "success":
-                    raise RuntimeError(f"生成报告失败: {report_result['error']}")
-                
-                # 保存原始diff文件
-                diff_result = analyzer.save_raw_diff_files(commit_id, commit_output_dir)
-                if diff_result["status"] != "success":
-                    raise RuntimeError(f"保存diff文件失败: {diff_result['error']}")
-                
-                # 统计信息
-                files_changed = len(diff_result["saved_files"])
-                total_files_changed += files_changed
-                total_commits_processed += 1
-                
-                print(f"Commit {commit_id[:8]} 处理完成, 修改文件数: {files_changed}")
-                
-            except Exception as e:
-                logger.error(f"处理commit {commit_id[:8]} 时出错: {str(e)}")
-                failed_commits.append({
-                    "commit_id": commit_id,
-                    "error": str(e)
-                })
-                continue
+            # 处理所有commit，各commit的diff文件写入互相重叠
+            total_commits_processed, total_files_changed, failed_commits = asyncio.run(
+                process_commits(analyzer, commits, all_diffs)
+            )
+        finally:
+            analyzer.close()
         
         # 打印最终摘要
         print("\n" + "="*50)
@@ -289,8 +785,8 @@ def main():
             "timestamp": str(datetime.now())
         }
         
-        with open("diff_reports/summary_report.json", "w", encoding="utf-8") as f:
-            json.dump(summary_report, f, indent=2, ensure_ascii=False)
+        with open("diff_reports/summary_report.json", "wb") as f:
+            f.write(_dump_json(summary_report, pretty))
             
         print(f"汇总报告已保存到: diff_reports/summary_report.json")
         
@@ -299,4 +795,7 @@ def main():
         raise
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="分析GitLab项目最近commits的差异")
+    parser.add_argument("--pretty", action="store_true", help="额外输出缩进的单独JSON报告，汇总报告也缩进，便于人工查看")
+    args = parser.parse_args()
+    main(pretty=args.pretty)
\ No newline at end of file
@@ -0,0 +1,12 @@
+import os
+import sys
+
+import pytest
+
+# 脚本位于仓库根目录，不是可安装的包
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def llm_cache_path(tmp_path):
+    return str(tmp_path / "llm_cache.db")
@@ -0,0 +1,39 @@
+from types import SimpleNamespace
+
+
+def make_completion(content, finish_reason="stop"):
+    """构造chat.completions.create返回值中被用到的部分"""
+    return SimpleNamespace(choices=[
+        SimpleNamespace(finish_reason=finish_reason, message=SimpleNamespace(content=content))
+    ])
+
+
+class FakeRawCompletions:
+    """
+    替代 `ai_client.chat.completions.with_raw_response`，按reply(**请求参数)返回
+    (内容, finish_reason)，并记录每次请求的参数
+    """
+
+    def __init__(self, reply):
+        self.reply = reply
+        self.calls = []
+
+    async def create(self, **request):
+        self.calls.append(request)
+        content, finish_reason = self.reply(**request)
+        completion = make_completion(content, finish_reason)
+        return SimpleNamespace(headers={}, parse=lambda: completion)
+
+
+def install_fake_chat(owner, reply):
+    """把owner.ai_client的with_raw_response替换为FakeRawCompletions并返回它"""
+    fake = FakeRawCompletions(reply)
+    owner.ai_client = SimpleNamespace(
+        chat=SimpleNamespace(completions=SimpleNamespace(with_raw_response=fake)),
+        close=_noop
+    )
+    return fake
+
+
+async def _noop():
+    return None
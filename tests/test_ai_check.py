@@ -0,0 +1,194 @@
+import asyncio
+
+import orjson
+import pytest
+
+import AI_check
+from AI_check import AICodeReviewer
+from fakes import install_fake_chat
+
+_FIX_REPLY = orjson.dumps({"verdict": "错", "fixed_code": "x = 2"}).decode()
+
+
+@pytest.fixture
+def reviewer_factory(tmp_path):
+    config = tmp_path / "AI_check_config.yaml"
+    config.write_text(
+        'api_key: "k"\n'
+        'base_url: "http://llm.test/v1"\n'
+        'model_name_1: "qwen-plus"\n'
+        f'llm_cache_path: "{(tmp_path / "llm_cache.db").as_posix()}"\n'
+        'max_requests_per_minute: 1000000000\n'
+        'max_tokens_per_minute: 1000000000000\n',
+        encoding="utf-8"
+    )
+    reviewers = []
+
+    def make(reply):
+        reviewer = AICodeReviewer(str(config))
+        fake = install_fake_chat(reviewer, reply)
+        reviewers.append(reviewer)
+        return reviewer, fake
+
+    yield make
+    for reviewer in reviewers:
+        reviewer.llm_cache.close()
+
+
+def _is_fix_request(request):
+    return "response_format" in request
+
+
+def _reply(fix=(_FIX_REPLY, "stop"), score=None):
+    def reply(messages, **request):
+        if _is_fix_request(request):
+            return fix
+        # 批量评分：按样本数返回等长的JSON数组
+        count = messages[-1]["content"].count("AI修正代码：")
+        return score or (orjson.dumps([{"score": 85, "suitable": "是"}] * count).decode(), "stop")
+    return reply
+
+
+def _run_batch(reviewer, rows):
+    batch = [(pos, bad, good, analysis) for pos, (bad, good, analysis) in enumerate(rows)]
+    return asyncio.run(AI_check.process_batch(reviewer, asyncio.Semaphore(4), batch, len(rows)))
+
+
+def test_fix_prompt_does_not_see_the_reference(reviewer_factory):
+    reviewer, fake = reviewer_factory(_reply())
+    results = _run_batch(reviewer, [("x = 1", "REFERENCE_FIX", "ANALYSIS")])
+
+    assert results == [(0, "错", "x = 2", 85, "是")]
+    fix_prompt, score_prompt = (call["messages"][-1]["content"] for call in fake.calls)
+    assert "REFERENCE_FIX" not in fix_prompt and "ANALYSIS" not in fix_prompt
+    # 评分请求对比的是AI自己的修复结果与人工修正代码
+    assert "REFERENCE_FIX" in score_prompt and "x = 2" in score_prompt
+
+
+def test_scores_for_a_batch_share_one_request(reviewer_factory):
+    reviewer, fake = reviewer_factory(_reply())
+    rows = [(f"x = {i}", f"x = {i} + 1", "a") for i in range(5)]
+    results = _run_batch(reviewer, rows)
+
+    assert [r[3] for r in results] == [85] * 5
+    fix_calls = [call for call in fake.calls if _is_fix_request(call)]
+    assert len(fix_calls) == 5
+    assert len(fake.calls) == 6
+
+
+def test_correct_code_skips_scoring(reviewer_factory):
+    reviewer, fake = reviewer_factory(_reply(fix=('{"verdict": "对", "fixed_code": ""}', "stop")))
+    results = _run_batch(reviewer, [("x = 1", "x = 2", "a")])
+
+    assert results == [(0, "对", "x = 1", 100, "是")]
+    assert len(fake.calls) == 1
+
+
+def test_truncated_fix_falls_back_and_is_not_cached(reviewer_factory):
+    reviewer, fake = reviewer_factory(_reply(fix=('{"verdict": "错", "fixed_co', "length")))
+    assert asyncio.run(reviewer.review_fix("x = 1")) == ("错", "x = 1")
+
+    reviewer, fake = reviewer_factory(_reply())
+    assert asyncio.run(reviewer.review_fix("x = 1")) == ("错", "x = 2")
+    assert len(fake.calls) == 1
+
+
+def test_unparseable_batch_score_falls_back_to_single_reviews(reviewer_factory):
+    def reply(messages, **request):
+        if _is_fix_request(request):
+            return _FIX_REPLY, "stop"
+        if "样本" in messages[-1]["content"]:
+            return "不是JSON", "stop"
+        return "70\n否", "stop"
+
+    reviewer, fake = reviewer_factory(reply)
+    results = _run_batch(reviewer, [("x = 1", "x = 2", "a"), ("y = 1", "y = 2", "b")])
+    assert [r[3:] for r in results] == [(70, "否"), (70, "否")]
+
+
+def test_unparseable_scores_are_not_cached(reviewer_factory):
+    def reply(messages, **request):
+        if _is_fix_request(request):
+            return _FIX_REPLY, "stop"
+        return "不是评分", "stop"
+
+    reviewer, fake = reviewer_factory(reply)
+    assert _run_batch(reviewer, [("x = 1", "x = 2", "a")]) == [(0, "错", "x = 2", 0, "否")]
+
+    # 修正代码已缓存，评分下次运行时重新请求
+    reviewer, fake = reviewer_factory(_reply())
+    assert _run_batch(reviewer, [("x = 1", "x = 2", "a")]) == [(0, "错", "x = 2", 85, "是")]
+    assert len(fake.calls) == 1 and not _is_fix_request(fake.calls[0])
+
+
+def test_offline_batch_runs_fix_then_batched_score(reviewer_factory, monkeypatch, tmp_path):
+    submitted = []
+
+    async def fake_batch(ai_client, requests, work_dir, **kwargs):
+        submitted.append((work_dir, [custom_id for custom_id, _ in requests]))
+        contents = {}
+        for custom_id, body in requests:
+            prompt = body["messages"][-1]["content"]
+            if "response_format" in body:
+                contents[custom_id] = '{"verdict": "对"}' if "ok" in prompt else _FIX_REPLY
+            else:
+                count = prompt.count("AI修正代码：")
+                contents[custom_id] = orjson.dumps([{"score": 70, "suitable": "否"}] * count).decode()
+        return contents
+
+    monkeypatch.setattr(AI_check, "run_chat_batch", fake_batch)
+    monkeypatch.setattr(AI_check, "BATCH_SIZE", 2)
+    batch = [
+        (0, "x = 1", "x = 2", "a"),
+        (2, "ok", "ok", "a"),
+        (3, "y = 1", "y = 2", "a"),
+        (5, "z = 1", "z = 2", "a"),
+    ]
+    work_dir = str(tmp_path / "batch")
+    reviewer, fake = reviewer_factory(_reply())
+    results = asyncio.run(AI_check.review_rows_offline(reviewer, batch, work_dir))
+
+    assert results == [
+        (0, "错", "x = 2", 70, "否"),
+        (2, "对", "ok", 100, "是"),
+        (3, "错", "x = 2", 70, "否"),
+        (5, "错", "x = 2", 70, "否"),
+    ]
+    assert submitted[0] == (work_dir, ["0", "2", "3", "5"])
+    # 三个为"错"的行按BATCH_SIZE打包为两个评分请求
+    assert submitted[1][1] == ["0", "2"]
+    assert submitted[1][0].endswith("second_review")
+    assert fake.calls == []
+
+    # 结果已写入响应缓存，再次运行不再提交
+    reviewer, _ = reviewer_factory(_reply())
+    assert asyncio.run(AI_check.review_rows_offline(reviewer, batch, work_dir)) == results
+    assert submitted[2:] == [(work_dir, []), (submitted[1][0], [])]
+
+
+def test_write_csv_round_trip(tmp_path):
+    path = str(tmp_path / "out.csv")
+    rows = [{"a": "多行\n文本", "b": 1}, {"a": 'q"uote', "b": None}]
+    AI_check.write_csv_data(["a", "b"], rows, path)
+    fieldnames, read = AI_check.read_csv_data(path)
+    assert fieldnames == ["a", "b"]
+    assert read == [{"a": "多行\n文本", "b": "1"}, {"a": 'q"uote', "b": ""}]
+
+
+def test_write_csv_keeps_crlf_inside_values(tmp_path):
+    path = str(tmp_path / "out.csv")
+    AI_check.write_csv_data(["a"], [{"a": "x = 1;\r\ny = 2;"}], path)
+    assert AI_check.read_csv_data(path)[1] == [{"a": "x = 1;\r\ny = 2;"}]
+
+
+def test_write_csv_without_rows_writes_the_header(tmp_path):
+    path = str(tmp_path / "out.csv")
+    AI_check.write_csv_data(["a", "b"], [], path)
+    assert AI_check.read_csv_data(path) == (["a", "b"], [])
+
+
+def test_write_csv_accepts_mixed_column_types(tmp_path):
+    path = str(tmp_path / "out.csv")
+    rows = [{"a": 1, "b": "是"}, {"a": "x", "b": True}]
+    AI_check.write_csv_data(["a", "b"], rows, path)
+    assert AI_check.read_csv_data(path)[1] == [{"a": "1", "b": "是"}, {"a": "x", "b": "True"}]
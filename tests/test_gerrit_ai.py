@@ -0,0 +1,280 @@
+import asyncio
+
+import pytest
+
+import gerrit_AI
+from gerrit_AI import GerritClient
+from fakes import install_fake_chat
+
+_BUG_REPLY = "[判断]是\n[类型]逻辑错误\n[描述]修复了边界条件"
+_NOT_BUG_REPLY = "[判断]否\n[类型]功能增加\n[描述]新增功能"
+
+
+@pytest.fixture
+def client_factory(tmp_path):
+    config = tmp_path / "gerrit_AI_config.yaml"
+    config.write_text(
+        'host: "gerrit.test"\n'
+        'username: "u"\n'
+        'password: "p"\n'
+        'api_key: "k"\n'
+        'base_url: "http://llm.test/v1"\n'
+        'model_name: "qwen-plus"\n'
+        f'llm_cache_path: "{(tmp_path / "llm_cache.db").as_posix()}"\n'
+        'max_requests_per_minute: 1000000000\n'
+        'max_tokens_per_minute: 1000000000000\n',
+        encoding="utf-8"
+    )
+    clients = []
+
+    def make():
+        client = GerritClient(str(config))
+        clients.append(client)
+        return client
+
+    yield make
+    for client in clients:
+        asyncio.run(client.aclose())
+
+
+def _patch(number, order):
+    return f"--- a/f{order}.c\n+++ b/f{order}.c\n-x = {number};\n+x = {number} + {order};\n"
+
+
+class _FakeGerrit:
+    """替换GerritClient的下载方法，记录在途的Gerrit请求与尚未分析的patch数"""
+
+    def __init__(self, client, files_per_change):
+        self.files_per_change = files_per_change
+        self.outstanding = 0
+        self.max_outstanding = 0
+        client.get_change_files = self.get_change_files
+        client.get_well_formatted_patch = self.get_well_formatted_patch
+
+    def _enter(self):
+        self.outstanding += 1
+        self.max_outstanding = max(self.max_outstanding, self.outstanding)
+
+    async def get_change_files(self, change_id):
+        self._enter()
+        await asyncio.sleep(0)
+        self.outstanding -= 1
+        return [f"f{i}.c" for i in range(self.files_per_change)]
+
+    async def get_well_formatted_patch(self, change_id, file_path):
+        # 名额在AI分析完成时归还(见reply)
+        self._enter()
+        await asyncio.sleep(0)
+        return _patch(int(change_id), int(file_path[1:-2]))
+
+
+def _changes(n):
+    return [
+        {"id": str(i), "_number": i, "subject": f"Fix bug {i}" if i % 5 else f"Refactor {i}"}
+        for i in range(n)
+    ]
+
+
+def _is_bug_patch(content):
+    # 变更号为偶数的patch判为bug修复
+    return "x = " in content and int(content.split("x = ")[1].split(";")[0]) % 2 == 0
+
+
+def test_pipeline_keeps_order_and_bounds_in_flight_work(client_factory):
+    client = client_factory()
+    gerrit = _FakeGerrit(client, files_per_change=3)
+
+    def reply(messages, **request):
+        gerrit.outstanding -= 1
+        return (_BUG_REPLY if _is_bug_patch(messages[-1]["content"]) else _NOT_BUG_REPLY), "stop"
+
+    fake = install_fake_chat(client, reply)
+    results = asyncio.run(client.filter_bug_fixes(_changes(200), ["bug"]))
+
+    expected = [i for i in range(200) if i % 5 and i % 2 == 0]
+    assert [result["number"] for result in results] == expected
+    for result in results:
+        assert [f["path"] for f in result["files"]] == ["f0.c", "f1.c", "f2.c"]
+        assert result["matched_keywords"] == ["bug"]
+        assert result["files"][0]["bug_type"] == "逻辑错误"
+    assert len(fake.calls) == 160 * 3
+    assert gerrit.outstanding == 0
+    assert gerrit.max_outstanding <= gerrit_AI._QUEUE_SIZE
+
+
+def test_async_change_stream_is_accepted(client_factory):
+    client = client_factory()
+    _FakeGerrit(client, files_per_change=1)
+    install_fake_chat(client, lambda **request: (_BUG_REPLY, "stop"))
+
+    async def stream():
+        for change in _changes(4):
+            yield change
+
+    results = asyncio.run(client.filter_bug_fixes(stream(), ["bug"]))
+    assert [result["number"] for result in results] == [1, 2, 3]
+
+
+def test_download_errors_are_reported_per_file(client_factory, capsys):
+    client = client_factory()
+    _FakeGerrit(client, files_per_change=2)
+
+    async def broken_patch(change_id, file_path):
+        if file_path == "f0.c":
+            raise RuntimeError("HTTP 500")
+        return _patch(2, 1)
+
+    client.get_well_formatted_patch = broken_patch
+    install_fake_chat(client, lambda **request: (_BUG_REPLY, "stop"))
+
+    results = asyncio.run(client.filter_bug_fixes([{"id": "2", "_number": 2, "subject": "bug"}], ["bug"]))
+    assert [f["path"] for f in results[0]["files"]] == ["f1.c"]
+    assert "处理文件 f0.c 时出错: HTTP 500" in capsys.readouterr().out
+
+
+def test_duplicate_patches_are_analyzed_once(client_factory):
+    client = client_factory()
+
+    async def files(change_id):
+        return ["a.c"]
+
+    async def patch(change_id, file_path):
+        return _patch(2, 1)
+
+    client.get_change_files = files
+    client.get_well_formatted_patch = patch
+    fake = install_fake_chat(client, lambda **request: (_BUG_REPLY, "stop"))
+
+    changes = [{"id": str(i), "_number": i, "subject": "bug"} for i in range(5)]
+    results = asyncio.run(client.filter_bug_fixes(changes, ["bug"]))
+    assert len(results) == 5
+    assert len(fake.calls) == 1
+
+
+def test_trivial_diffs_skip_the_llm(client_factory):
+    client = client_factory()
+    fake = install_fake_chat(client, lambda **request: (_BUG_REPLY, "stop"))
+    patches = {
+        "f0.c": "-  x = 1;\n+x = 1;   \n",
+        "f1.c": "-// old\n+// new\n",
+        "f2.c": "-#include <a.h>\n+#include <b.h>\n",
+    }
+
+    async def files(change_id):
+        return list(patches)
+
+    async def patch(change_id, file_path):
+        return patches[file_path]
+
+    client.get_change_files = files
+    client.get_well_formatted_patch = patch
+    results = asyncio.run(client.filter_bug_fixes([{"id": "1", "_number": 1, "subject": "bug"}], ["bug"]))
+    assert results == []
+    assert fake.calls == []
+
+
+def test_response_cache_is_reused_across_runs(client_factory):
+    first = client_factory()
+    _FakeGerrit(first, files_per_change=1)
+    install_fake_chat(first, lambda **request: (_BUG_REPLY, "stop"))
+    asyncio.run(first.filter_bug_fixes(_changes(4), ["bug"]))
+
+    second = client_factory()
+    _FakeGerrit(second, files_per_change=1)
+    fake = install_fake_chat(second, lambda **request: (_NOT_BUG_REPLY, "stop"))
+    results = asyncio.run(second.filter_bug_fixes(_changes(4), ["bug"]))
+    assert [result["number"] for result in results] == [1, 2, 3]
+    assert fake.calls == []
+
+
+def test_invalid_and_truncated_replies_are_retried_next_run(client_factory):
+    replies = [("[判断]是\n[类型]逻辑", "length"), ("不知道", "stop"), (_BUG_REPLY, "stop")]
+    for expected_numbers in ([], [], [1]):
+        client = client_factory()
+        _FakeGerrit(client, files_per_change=1)
+        install_fake_chat(client, lambda **request: replies.pop(0))
+        results = asyncio.run(client.filter_bug_fixes(_changes(2)[1:], ["bug"]))
+        assert [result["number"] for result in results] == expected_numbers
+    assert replies == []
+
+
+class _FakeSemanticCache:
+    def __init__(self, result):
+        self.result = result
+        self.lookups = 0
+        self.added = []
+
+    def lookup(self, text):
+        self.lookups += 1
+        return self.result
+
+    def add(self, text, result):
+        self.added.append(result)
+
+
+def test_exact_cache_is_checked_before_semantic_cache(client_factory):
+    first = client_factory()
+    _FakeGerrit(first, files_per_change=1)
+    install_fake_chat(first, lambda **request: (_BUG_REPLY, "stop"))
+    asyncio.run(first.filter_bug_fixes(_changes(2)[1:], ["bug"]))
+
+    second = client_factory()
+    _FakeGerrit(second, files_per_change=1)
+    fake = install_fake_chat(second, lambda **request: (_NOT_BUG_REPLY, "stop"))
+    second.semantic_cache = _FakeSemanticCache([False, "近似", "近似结论"])
+    results = asyncio.run(second.filter_bug_fixes(_changes(2)[1:], ["bug"]))
+
+    assert [result["number"] for result in results] == [1]
+    assert second.semantic_cache.lookups == 0
+    assert fake.calls == []
+
+
+def test_semantic_cache_is_used_on_exact_miss(client_factory):
+    client = client_factory()
+    _FakeGerrit(client, files_per_change=1)
+    fake = install_fake_chat(client, lambda **request: (_NOT_BUG_REPLY, "stop"))
+    client.semantic_cache = _FakeSemanticCache([True, "近似", "近似结论"])
+    results = asyncio.run(client.filter_bug_fixes(_changes(2)[1:], ["bug"]))
+
+    assert results[0]["files"][0]["bug_desc"] == "近似结论"
+    assert client.semantic_cache.lookups == 1
+    assert fake.calls == []
+
+
+def test_fresh_analyses_are_added_to_the_semantic_cache(client_factory):
+    client = client_factory()
+    _FakeGerrit(client, files_per_change=1)
+    install_fake_chat(client, lambda **request: (_BUG_REPLY, "stop"))
+    client.semantic_cache = _FakeSemanticCache(None)
+    asyncio.run(client.filter_bug_fixes(_changes(2)[1:], ["bug"]))
+
+    assert client.semantic_cache.added == [[True, "逻辑错误", "修复了边界条件"]]
+
+
+def test_offline_batch_submits_each_patch_once(client_factory, monkeypatch, tmp_path):
+    submitted = []
+
+    async def fake_batch(ai_client, requests, work_dir, **kwargs):
+        submitted.append([custom_id for custom_id, _ in requests])
+        # 第一个请求没有结果
+        return {custom_id: _BUG_REPLY for custom_id, _ in requests[1:]}
+
+    monkeypatch.setattr(gerrit_AI, "run_chat_batch", fake_batch)
+
+    client = client_factory()
+    fake = install_fake_chat(client, lambda **request: (_NOT_BUG_REPLY, "stop"))
+    _FakeGerrit(client, files_per_change=2)
+    results = asyncio.run(client.filter_bug_fixes(
+        _changes(3)[1:], ["bug"], offline_batch=True, batch_dir=str(tmp_path / "batch")
+    ))
+    assert submitted == [["0", "1", "2", "3"]]
+    assert [[f["path"] for f in result["files"]] for result in results] == [["f1.c"], ["f0.c", "f1.c"]]
+    assert fake.calls == []
+
+    # 结果已写入共享的响应缓存，再次运行时只提交上次没有结果的请求
+    client = client_factory()
+    _FakeGerrit(client, files_per_change=2)
+    asyncio.run(client.filter_bug_fixes(
+        _changes(3)[1:], ["bug"], offline_batch=True, batch_dir=str(tmp_path / "batch")
+    ))
+    assert submitted[1] == ["0"]
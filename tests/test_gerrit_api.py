@@ -0,0 +1,51 @@
+import io
+import types
+
+from utils.gerrit_api import GerritAPI
+
+_BODY = b')]}\'\n[{"_number": 1, "subject": "a"}, {"_number": 2, "subject": "b"}]'
+
+
+class _FakeResponse:
+    def __init__(self, body):
+        self.raw = io.BytesIO(body)
+
+    def raise_for_status(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+def _api(body=_BODY):
+    api = GerritAPI("http://gerrit.test/a", "u", "p")
+    api.requests = []
+
+    def get(url, params=None, **kwargs):
+        api.requests.append((url, params))
+        return _FakeResponse(body)
+
+    api.session.get = get
+    return api
+
+
+def test_iter_changes_streams_items_after_the_prefix():
+    api = _api()
+    changes = api.iter_changes("status:merged", limit=2)
+    assert isinstance(changes, types.GeneratorType)
+    assert api.requests == []
+
+    assert next(changes) == {"_number": 1, "subject": "a"}
+    assert [change["_number"] for change in changes] == [2]
+    assert api.requests == [("http://gerrit.test/a/changes/", {"q": "status:merged", "n": 2})]
+
+
+def test_get_changes_returns_a_list():
+    assert _api().get_changes("status:merged") == [
+        {"_number": 1, "subject": "a"},
+        {"_number": 2, "subject": "b"},
+    ]
+    assert _api(b")]}'\n[]").get_changes("status:merged") == []
@@ -0,0 +1,358 @@
+import asyncio
+import io
+from pathlib import Path
+
+import pytest
+
+import gitlab
+from gitlab import GitLabCommitAnalyzer
+from utils.log import logger
+
+_CONFIG = {"GITLAB": {"HOST": "gitlab.test", "TOKEN": "t"}}
+
+
+@pytest.fixture(autouse=True)
+def _quiet_logs():
+    # 测试产生的日志不写入仓库中的logs/debug.log
+    logger.disable("")
+    yield
+    logger.enable("")
+
+
+@pytest.fixture
+def analyzer(tmp_path, monkeypatch):
+    # 报告目录与ETag记录都是相对路径，在临时目录中运行
+    monkeypatch.chdir(tmp_path)
+    analyzer = GitLabCommitAnalyzer(dict(_CONFIG))
+    analyzer.project_id = 7
+    analyzer.ref = "main"
+    return analyzer
+
+
+@pytest.mark.parametrize("diff, expected", [
+    ({}, "modified"),
+    ({"new_file": True}, "added"),
+    ({"deleted_file": True}, "deleted"),
+    ({"renamed_file": True}, "renamed"),
+    ({"new_file": True, "deleted_file": True, "renamed_file": True}, "added"),
+    ({"deleted_file": True, "renamed_file": True}, "deleted"),
+])
+def test_change_map(diff, expected):
+    flags = (bool(diff.get("new_file")), bool(diff.get("deleted_file")), bool(diff.get("renamed_file")))
+    assert gitlab._CHANGE_MAP[flags] == expected
+    assert len(gitlab._CHANGE_MAP) == 8
+
+
+def test_diff_report_lists_change_types(analyzer, tmp_path):
+    diffs = [
+        {"old_path": "a.c", "new_path": "a.c", "diff": "@@ -1 +1 @@\n-x\n+y\n"},
+        {"old_path": "b.c", "new_path": "b.c", "new_file": True, "diff": "+z\n"},
+        {"old_path": "c.c", "new_path": "d.c", "renamed_file": True, "diff": ""},
+    ]
+    result = analyzer.generate_diff_report("0123456789abcdef", str(tmp_path), diffs=diffs)
+    analyzer.close()
+
+    assert result["status"] == "success"
+    assert result["files_changed"] == ["a.c", "b.c", "d.c"]
+    report = gitlab._load_json((tmp_path / gitlab._REPORT_JSONL).read_bytes())
+    assert [f["change_type"] for f in report["files"]] == ["modified", "added", "renamed"]
+
+
+def test_reports_are_appended_to_one_jsonl_with_an_offset_index(analyzer, tmp_path):
+    first = analyzer.generate_diff_report("a" * 40, diffs=[{"old_path": "a.c", "new_path": "a.c", "diff": "+a\n"}])
+    second = analyzer.generate_diff_report("b" * 40, diffs=[{"old_path": "b.c", "new_path": "b.c", "diff": "+b\n"}])
+    analyzer.close()
+
+    assert first["report_offset"] == 0
+    assert first["report_path"] == second["report_path"] == str(tmp_path / gitlab._REPORT_JSONL)
+    content = (tmp_path / gitlab._REPORT_JSONL).read_bytes()
+    index = gitlab._load_json((tmp_path / gitlab._REPORT_INDEX).read_bytes())
+    assert second["report_offset"] == index["b" * 40][0] > 0
+    for commit_id, (offset, length, _) in index.items():
+        report = gitlab._load_json(content[offset:offset + length])
+        assert report["commit_id"] == commit_id and report["timestamp"]
+    assert content.count(b"\n") == 2
+    assert not list(tmp_path.glob("diff_report_*.json"))
+
+
+def test_unchanged_diffs_are_not_appended_again(analyzer, tmp_path):
+    diffs = [{"old_path": "a.c", "new_path": "a.c", "diff": "+a\n"}]
+    first = analyzer.generate_diff_report("a" * 40, diffs=diffs)
+    again = analyzer.generate_diff_report("a" * 40, diffs=[dict(d) for d in diffs])
+    changed = analyzer.generate_diff_report("a" * 40, diffs=[{"old_path": "a.c", "new_path": "a.c", "diff": "+b\n"}])
+    analyzer.close()
+
+    assert again["report_offset"] == first["report_offset"] == 0
+    assert changed["report_offset"] > 0
+    content = (tmp_path / gitlab._REPORT_JSONL).read_bytes()
+    assert content.count(b"\n") == 2
+    offset, length, _ = gitlab._load_json((tmp_path / gitlab._REPORT_INDEX).read_bytes())["a" * 40]
+    assert offset == changed["report_offset"]
+    assert b"+b" in content[offset:offset + length]
+
+
+@pytest.mark.parametrize("use_aiofiles", [True, False])
+def test_save_raw_diff_files_writes_each_file(analyzer, tmp_path, monkeypatch, use_aiofiles):
+    if not use_aiofiles:
+        monkeypatch.setattr(gitlab, "aiofiles", None)
+    elif gitlab.aiofiles is None:
+        pytest.skip("aiofiles未安装")
+    diffs = [
+        {"old_path": "src/a.c", "new_path": "src/a.c", "diff": "-x\n+y\n"},
+        {"old_path": "b.c", "new_path": "", "deleted_file": True, "diff": "-z\n"},
+        {"old_path": "", "new_path": "", "diff": "ignored"},
+    ]
+    result = asyncio.run(analyzer.save_raw_diff_files("0123456789abcdef", str(tmp_path), diffs=diffs))
+
+    assert result["status"] == "success"
+    assert [Path(p).name for p in result["saved_files"]] == ["src_a.c.diff", "b.c.diff"]
+    assert (tmp_path / "src_a.c.diff").read_bytes() == b"--- src/a.c\n+++ src/a.c\n-x\n+y\n"
+    assert (tmp_path / "b.c.diff").read_bytes() == b"--- b.c\n+++ \n-z\n"
+
+
+def test_safe_name_table_replaces_separators_and_reserved_characters(analyzer, tmp_path):
+    assert 'dir/sub\\a:b*c?"d"<e>|f.c'.translate(gitlab._SAFE_NAME_TABLE) == "dir_sub_a_b_c__d__e__f.c"
+    diffs = [{"old_path": "src/win:name?.c", "new_path": "src/win:name?.c", "diff": "+x\n"}]
+    result = asyncio.run(analyzer.save_raw_diff_files("0123456789abcdef", str(tmp_path), diffs=diffs))
+    assert [Path(p).name for p in result["saved_files"]] == ["src_win_name_.c.diff"]
+
+
+def test_colliding_safe_names_keep_the_last_diff(analyzer, tmp_path):
+    diffs = [
+        {"old_path": "a/b_c", "new_path": "a/b_c", "diff": "+first\n"},
+        {"old_path": "a_b/c", "new_path": "a_b/c", "diff": "+second\n"},
+    ]
+    result = asyncio.run(analyzer.save_raw_diff_files("0123456789abcdef", str(tmp_path), diffs=diffs))
+
+    assert len(result["saved_files"]) == 2
+    assert (tmp_path / "a_b_c.diff").read_bytes() == b"--- a_b/c\n+++ a_b/c\n+second\n"
+
+
+def test_save_raw_diff_files_can_run_in_separate_event_loops(analyzer, tmp_path):
+    # 同步调用方每次用asyncio.run驱动，写文件的信号量不能绑定在第一个事件循环上
+    diffs = [{"old_path": "a.c", "new_path": "a.c", "diff": "+x\n"}]
+    for name in ("first", "second"):
+        result = asyncio.run(analyzer.save_raw_diff_files("0123456789abcdef", str(tmp_path / name), diffs=diffs))
+        assert result["status"] == "success"
+
+
+def test_null_diff_writes_an_empty_body(analyzer, tmp_path):
+    diffs = [{"old_path": "bin.dat", "new_path": "bin.dat", "diff": None}]
+    result = asyncio.run(analyzer.save_raw_diff_files("0123456789abcdef", str(tmp_path), diffs=diffs))
+
+    assert result["status"] == "success"
+    assert (tmp_path / "bin.dat.diff").read_bytes() == b"--- bin.dat\n+++ bin.dat\n"
+
+
+def test_process_commits_reports_failures(analyzer, tmp_path):
+    commits = [{"id": "a" * 40, "message": "ok\n"}, {"id": "b" * 40, "message": "broken\n"}]
+    all_diffs = {
+        "a" * 40: [{"old_path": "a.c", "new_path": "a.c", "diff": "+x\n"}],
+        "b" * 40: RuntimeError("HTTP 500"),
+    }
+    processed, files_changed, failed = asyncio.run(gitlab.process_commits(analyzer, commits, all_diffs))
+
+    assert (processed, files_changed) == (1, 1)
+    assert failed == [{"commit_id": "b" * 40, "error": "获取差异数据失败: HTTP 500"}]
+    assert (tmp_path / "diff_reports" / "commit_aaaaaaaa" / "a.c.diff").exists()
+
+
+_DIFFS = [{"old_path": "a.c", "new_path": "a.c", "diff": "-x\n+y\n"}]
+_COMMIT = "c" * 40
+
+
+class _FakeResponse:
+    """替代requests.Response，支持stream=True时的raw读取和with语句"""
+
+    def __init__(self, status, diffs=None, etag=None):
+        self.status_code = status
+        self.content = gitlab._dump_json(diffs) if diffs is not None else b""
+        self.raw = io.BytesIO(self.content)
+        self.headers = {"ETag": etag} if etag else {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(f"HTTP {self.status_code}")
+
+
+class _FakeSession:
+    """替代requests.Session，按顺序返回预设响应并记录每次请求的头"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.sent_headers = []
+
+    def get(self, endpoint, headers=None, **kwargs):
+        self.sent_headers.append(headers)
+        return self.responses.pop(0)
+
+
+def _save_report(analyzer):
+    result = analyzer.generate_diff_report(_COMMIT, f"diff_reports/commit_{_COMMIT[:8]}", _DIFFS)
+    assert result["status"] == "success"
+
+
+def test_etag_is_sent_and_304_reuses_the_saved_report(analyzer):
+    analyzer._s = _FakeSession(_FakeResponse(200, _DIFFS, etag='"v1"'))
+    assert analyzer.get_commit_diff(_COMMIT) == _DIFFS
+    assert analyzer._s.sent_headers == [None]
+    _save_report(analyzer)
+    analyzer.close()
+
+    rerun = GitLabCommitAnalyzer(dict(_CONFIG))
+    rerun.project_id = 7
+    rerun._s = _FakeSession(_FakeResponse(304))
+    assert rerun.get_commit_diff(_COMMIT) == _DIFFS
+    assert rerun._s.sent_headers == [{"If-None-Match": '"v1"'}]
+
+    # 304命中的commit沿用已有的报告行，不再追加
+    _save_report(rerun)
+    rerun.close()
+    assert Path(gitlab._REPORT_JSONL).read_bytes().count(b"\n") == 1
+
+
+def test_304_without_a_saved_report_refetches(analyzer):
+    analyzer._etags[_COMMIT] = '"v1"'
+    analyzer._s = _FakeSession(_FakeResponse(304), _FakeResponse(200, _DIFFS, etag='"v2"'))
+    assert analyzer.get_commit_diff(_COMMIT) == _DIFFS
+    assert analyzer._s.sent_headers == [{"If-None-Match": '"v1"'}, None]
+    assert analyzer._etags[_COMMIT] == '"v2"'
+
+
+class _FakeStreamReader:
+    """替代aiohttp.StreamReader，记录已读取的字节数"""
+
+    def __init__(self, content):
+        self._raw = io.BytesIO(content)
+
+    @property
+    def position(self):
+        return self._raw.tell()
+
+    async def read(self, n=-1):
+        return self._raw.read(n)
+
+
+class _FakeAioResponse:
+    def __init__(self, response):
+        self.status = response.status_code
+        self.headers = response.headers
+        self.content = _FakeStreamReader(response.content)
+        self._response = response
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def read(self):
+        return self._response.content
+
+    def raise_for_status(self):
+        self._response.raise_for_status()
+
+
+class _FakeAioSession(_FakeSession):
+    """替代aiohttp.ClientSession"""
+
+    def get(self, endpoint, headers=None):
+        self.last = _FakeAioResponse(super().get(endpoint, headers))
+        return self.last
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+
+def test_async_fetch_falls_back_when_the_saved_report_is_gone(analyzer):
+    analyzer._etags[_COMMIT] = '"v1"'
+    session = _FakeAioSession(_FakeResponse(304), _FakeResponse(200, _DIFFS, etag='"v2"'))
+    result = asyncio.run(analyzer.fetch_commit_diff(session, asyncio.Semaphore(1), _COMMIT))
+
+    assert result == (_COMMIT, _DIFFS)
+    assert session.sent_headers == [{"If-None-Match": '"v1"'}, None]
+    assert analyzer._etags[_COMMIT] == '"v2"'
+
+
+def test_async_fetch_reuses_the_saved_report_on_304(analyzer):
+    _save_report(analyzer)
+    analyzer._etags[_COMMIT] = '"v1"'
+    session = _FakeAioSession(_FakeResponse(304))
+    assert asyncio.run(analyzer.fetch_commit_diff(session, asyncio.Semaphore(1), _COMMIT)) == (_COMMIT, _DIFFS)
+
+
+def _stream(analyzer, session, commit_id=_COMMIT):
+    return asyncio.run(analyzer.stream_commit(
+        session, asyncio.Semaphore(1), asyncio.Semaphore(4), commit_id, f"diff_reports/commit_{commit_id[:8]}"
+    ))
+
+
+def test_stream_commit_writes_each_diff_before_the_body_is_read(analyzer, tmp_path, monkeypatch):
+    # 每个diff大于ijson的读缓冲，整段读完之前就应写出前面的diff文件
+    diffs = [{"old_path": f"f{i}.c", "new_path": f"f{i}.c", "diff": f"+{i}" * 40000} for i in range(3)]
+    session = _FakeAioSession(_FakeResponse(200, diffs, etag='"v1"'))
+    positions = []
+    write_limited = gitlab._write_limited
+
+    async def recording_write(sem, path, *chunks):
+        positions.append(session.last.content.position)
+        await write_limited(sem, path, *chunks)
+
+    monkeypatch.setattr(gitlab, "_write_limited", recording_write)
+    result = _stream(analyzer, session)
+
+    assert result["status"] == "success"
+    assert result["files_changed"] == ["f0.c", "f1.c", "f2.c"]
+    assert positions[0] < len(gitlab._dump_json(diffs))
+    assert (tmp_path / result["saved_files"][2]).read_bytes() == b"--- f2.c\n+++ f2.c\n" + b"+2" * 40000
+    assert analyzer._etags[_COMMIT] == '"v1"'
+
+
+def test_streamed_report_matches_the_list_report(analyzer, tmp_path):
+    diffs = _DIFFS + [{"old_path": "b.c", "new_path": "", "deleted_file": True, "diff": "-z\n", "a_mode": 100644}]
+    listed = analyzer.generate_diff_report(_COMMIT, diffs=diffs)
+    streamed = _stream(analyzer, _FakeAioSession(_FakeResponse(200, diffs)))
+    analyzer.close()
+
+    # 内容相同，流式写入命中已有的报告行
+    assert streamed["report_offset"] == listed["report_offset"] == 0
+    content = (tmp_path / gitlab._REPORT_JSONL).read_bytes()
+    assert content.count(b"\n") == 1
+    report = gitlab._load_json(content)
+    assert report["diffs"] == diffs
+    # diff正文只在diffs中保存一份
+    assert report["files"] == [
+        {"old_path": "a.c", "new_path": "a.c", "change_type": "modified"},
+        {"old_path": "b.c", "new_path": "", "change_type": "deleted"},
+    ]
+
+
+def test_stream_commit_reuses_the_saved_report_on_304(analyzer, tmp_path):
+    _save_report(analyzer)
+    analyzer._etags[_COMMIT] = '"v1"'
+    result = _stream(analyzer, _FakeAioSession(_FakeResponse(304)))
+    analyzer.close()
+
+    assert result["status"] == "success" and result["report_offset"] == 0
+    assert Path(result["saved_files"][0]).read_bytes() == b"--- a.c\n+++ a.c\n-x\n+y\n"
+    assert (tmp_path / gitlab._REPORT_JSONL).read_bytes().count(b"\n") == 1
+
+
+def test_process_commits_streams_when_no_diffs_are_given(analyzer, tmp_path):
+    commits = [{"id": "a" * 40, "message": "ok\n"}, {"id": "b" * 40, "message": "broken\n"}]
+    session = _FakeAioSession(_FakeResponse(200, _DIFFS), _FakeResponse(404))
+    analyzer.client_session = lambda: session
+    processed, files_changed, failed = asyncio.run(gitlab.process_commits(analyzer, commits))
+
+    assert (processed, files_changed) == (1, 1)
+    assert failed == [{"commit_id": "b" * 40, "error": "处理差异数据失败: HTTP 404"}]
+    assert (tmp_path / "diff_reports" / "commit_aaaaaaaa" / "a.c.diff").exists()
@@ -0,0 +1,65 @@
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from utils.gitlab_api import GitLabAPI
+from utils.log import logger
+
+
+@pytest.fixture(autouse=True)
+def _quiet_logs():
+    # 测试产生的日志不写入仓库中的logs/debug.log
+    logger.disable("")
+    yield
+    logger.enable("")
+
+
+@pytest.fixture
+def server():
+    requests_seen = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            requests_seen.append(self.path)
+            status, body = self.server.reply
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    httpd = HTTPServer(("127.0.0.1", 0), Handler)
+    httpd.requests_seen = requests_seen
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _api(server):
+    return GitLabAPI(f"http://127.0.0.1:{server.server_port}/api/v4", "t")
+
+
+def test_get_project_id_queries_the_encoded_path(server):
+    server.reply = (200, b'{"id": 42}')
+    assert _api(server).get_project_id("group/sub/repo") == 42
+    assert server.requests_seen == ["/api/v4/projects/group%2Fsub%2Frepo"]
+
+
+def test_get_project_id_reports_missing_projects(server):
+    server.reply = (404, b'{"message": "404 Project Not Found"}')
+    with pytest.raises(ValueError, match="未找到项目"):
+        _api(server).get_project_id("group/repo")
+
+
+def test_get_project_id_raises_value_error_after_retries(server):
+    server.reply = (503, b"{}")
+    with pytest.raises(ValueError, match="API请求失败: HTTP 503"):
+        _api(server).get_project_id("group/repo")
+    # 首次请求加3次重试
+    assert len(server.requests_seen) == 4
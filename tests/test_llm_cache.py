@@ -0,0 +1,122 @@
+import asyncio
+import threading
+
+import pytest
+
+from utils.llm_cache import LLMCache, cached_llm_call, make_cache_key
+
+
+class _Caller:
+    def __init__(self, cache, replies):
+        self.llm_cache = cache
+        self.replies = list(replies)
+        self.calls = 0
+
+    @cached_llm_call
+    async def chat(self, model, messages, temperature, max_tokens, **extra):
+        self.calls += 1
+        reply = self.replies.pop(0)
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+    @cached_llm_call
+    def chat_sync(self, model, messages, temperature, max_tokens, **extra):
+        self.calls += 1
+        return self.replies.pop(0)
+
+
+_MSGS = [{"role": "user", "content": "hi"}]
+
+
+def test_make_cache_key_is_deterministic_and_covers_extra():
+    key = make_cache_key("m", _MSGS, 0.1, 100)
+    assert key == make_cache_key("m", list(_MSGS), 0.1, 100)
+    assert key != make_cache_key("m", _MSGS, 0.1, 101)
+    assert key != make_cache_key("m", _MSGS, 0.1, 100, response_format={"type": "json_object"})
+
+
+def test_cache_round_trip_persists(llm_cache_path):
+    cache = LLMCache(llm_cache_path)
+    assert cache.get("k") is None
+    cache.set("k", "答案")
+    cache.close()
+
+    cache = LLMCache(llm_cache_path)
+    assert cache.get("k") == "答案"
+    cache.close()
+
+
+def test_cached_call_hits_cache_on_repeat(llm_cache_path):
+    caller = _Caller(LLMCache(llm_cache_path), ["a"])
+    for _ in range(3):
+        assert asyncio.run(caller.chat("m", _MSGS, 0.1, 10)) == "a"
+    assert caller.calls == 1
+
+
+class _ThreadRecordingCache(LLMCache):
+    def __init__(self, db_path):
+        super().__init__(db_path)
+        self.threads = []
+
+    def get(self, key):
+        self.threads.append(threading.get_ident())
+        return super().get(key)
+
+    def set(self, key, value):
+        self.threads.append(threading.get_ident())
+        super().set(key, value)
+
+
+def test_async_call_reads_and_writes_the_cache_off_the_event_loop(llm_cache_path):
+    caller = _Caller(_ThreadRecordingCache(llm_cache_path), ["a"])
+
+    async def run():
+        loop_thread = threading.get_ident()
+        results = [await caller.chat("m", _MSGS, 0.1, 10) for _ in range(2)]
+        return loop_thread, results
+
+    loop_thread, results = asyncio.run(run())
+    assert results == ["a", "a"]
+    # 未命中读、写入、命中读
+    assert len(caller.llm_cache.threads) == 3
+    assert loop_thread not in caller.llm_cache.threads
+
+
+def test_cache_if_rejects_invalid_replies(llm_cache_path):
+    caller = _Caller(LLMCache(llm_cache_path), ['{"verdict"', '{"verdict"', '{"verdict": "对"}', "unused"])
+    is_valid = lambda content: content.endswith("}")
+    results = [asyncio.run(caller.chat("m", _MSGS, 0.1, 10, cache_if=is_valid)) for _ in range(4)]
+
+    # 截断的回答照常返回但不缓存，直到得到合法回答
+    assert results == ['{"verdict"', '{"verdict"', '{"verdict": "对"}', '{"verdict": "对"}']
+    assert caller.calls == 3
+
+
+def test_cache_if_is_not_part_of_the_key(llm_cache_path):
+    caller = _Caller(LLMCache(llm_cache_path), ["a"])
+    asyncio.run(caller.chat("m", _MSGS, 0.1, 10, cache_if=lambda content: True))
+    assert caller.llm_cache.get(make_cache_key("m", _MSGS, 0.1, 10)) == "a"
+
+
+def test_exceptions_are_not_cached(llm_cache_path):
+    caller = _Caller(LLMCache(llm_cache_path), [RuntimeError("boom"), "a"])
+    with pytest.raises(RuntimeError):
+        asyncio.run(caller.chat("m", _MSGS, 0.1, 10))
+    assert asyncio.run(caller.chat("m", _MSGS, 0.1, 10)) == "a"
+    assert caller.calls == 2
+
+
+def test_sync_methods_are_cached(llm_cache_path):
+    caller = _Caller(LLMCache(llm_cache_path), ["bad", "good"])
+    is_valid = lambda content: content == "good"
+    assert caller.chat_sync("m", _MSGS, 0.1, 10, cache_if=is_valid) == "bad"
+    assert caller.chat_sync("m", _MSGS, 0.1, 10, cache_if=is_valid) == "good"
+    assert caller.chat_sync("m", _MSGS, 0.1, 10, cache_if=is_valid) == "good"
+    assert caller.calls == 2
+
+
+def test_without_cache_calls_through():
+    caller = _Caller(None, ["a", "b"])
+    assert asyncio.run(caller.chat("m", _MSGS, 0.1, 10)) == "a"
+    assert asyncio.run(caller.chat("m", _MSGS, 0.1, 10)) == "b"
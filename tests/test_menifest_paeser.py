@@ -0,0 +1,38 @@
+from utils.menifest_paeser import MParser
+
+_MANIFEST = b"""<?xml version="1.0" encoding="UTF-8"?>
+<manifest>
+  <remote name="aosp" fetch="https://android.test" />
+  <remote name="vendor" fetch="https://vendor.test" />
+  <default remote="aosp" revision="main" />
+  <project name="platform/build" revision="v1" />
+  <project name="vendor/hal" remote="vendor" revision="dev" />
+  <project name="platform/art" />
+</manifest>
+"""
+
+
+def test_projects_resolve_remote_and_branch():
+    projects = MParser(projectId=3).run(_MANIFEST)
+
+    assert [p["branch"] for p in projects] == ["v1", "dev", "main"]
+    assert projects[0]["target"] == "https://android.test/platform/build -b v1"
+    assert projects[1]["target"] == "https://vendor.test/vendor/hal -b dev"
+    assert projects[2]["target"].startswith("https://android.test/platform/art -b ")
+    assert all(p["trinityProjectId"] == 3 for p in projects)
+
+
+def test_nested_projects_are_included():
+    nested = _MANIFEST.replace(
+        b'<project name="platform/art" />',
+        b'<project name="platform/art"><project name="platform/art/sub" revision="v2" /></project>'
+    )
+    projects = MParser().run(nested)
+    assert len(projects) == 4
+    assert projects[2]["target"].startswith("https://android.test/platform/art -b ")
+    assert projects[3]["target"] == "https://android.test/platform/art/sub -b v2"
+
+
+def test_manifest_nested_in_another_root_is_found():
+    wrapped = b"<root>" + _MANIFEST.split(b"?>", 1)[1] + b"</root>"
+    assert len(MParser().run(wrapped)) == 3
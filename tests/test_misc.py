@@ -0,0 +1,24 @@
+import os
+
+from utils.misc import load_yaml
+
+
+def test_load_yaml_is_cached_until_the_file_changes(tmp_path):
+    path = tmp_path / "config.yaml"
+    path.write_text("a: 1\n", encoding="utf-8")
+    first = load_yaml(str(path))
+    assert first == {"a": 1}
+    assert load_yaml(str(path)) is first
+
+    path.write_text("a: 2\n", encoding="utf-8")
+    # 显式推进修改时间，避免文件系统时间精度导致mtime不变
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert load_yaml(str(path)) == {"a": 2}
+
+
+def test_relative_and_absolute_paths_share_the_cache(tmp_path, monkeypatch):
+    path = tmp_path / "config.yaml"
+    path.write_text("b: [1, 2]\n", encoding="utf-8")
+    monkeypatch.chdir(tmp_path)
+    assert load_yaml("config.yaml") is load_yaml(str(path))
@@ -0,0 +1,97 @@
+import asyncio
+from types import SimpleNamespace
+
+import orjson
+
+from utils.openai_batch import run_chat_batch
+
+
+class _FakeBatchClient:
+    """
+    模拟Batch API：每次提交按statuses依次给出终止状态，
+    answer(custom_id, 第几次提交)返回(状态码, 内容, finish_reason)或None(无输出)
+    """
+
+    def __init__(self, answer, statuses=("completed",)):
+        self.answer = answer
+        self.statuses = list(statuses)
+        self.submitted = []
+        self._inputs = {}
+        self.files = SimpleNamespace(create=self._create_file, content=self._file_content)
+        self.batches = SimpleNamespace(create=self._create_batch, retrieve=self._retrieve_batch)
+
+    async def _create_file(self, file, purpose):
+        file_id = f"file-{len(self._inputs)}"
+        self._inputs[file_id] = [orjson.loads(line) for line in file.read().splitlines()]
+        return SimpleNamespace(id=file_id)
+
+    async def _create_batch(self, input_file_id, endpoint, completion_window):
+        attempt = len(self.submitted)
+        records = self._inputs[input_file_id]
+        self.submitted.append([record["custom_id"] for record in records])
+        lines = []
+        for record in records:
+            answer = self.answer(record["custom_id"], attempt)
+            if answer is None:
+                continue
+            status_code, content, finish_reason = answer
+            lines.append(orjson.dumps({
+                "custom_id": record["custom_id"],
+                "response": {"status_code": status_code, "body": {"choices": [
+                    {"finish_reason": finish_reason, "message": {"content": content}}
+                ]}}
+            }))
+        output_id = f"out-{attempt}"
+        self._inputs[output_id] = b"\n".join(lines)
+        return SimpleNamespace(
+            id=f"batch-{attempt}", status=self.statuses[attempt],
+            output_file_id=output_id if lines else None, request_counts=None
+        )
+
+    async def _retrieve_batch(self, batch_id):
+        raise AssertionError("终止状态的批处理不应再轮询")
+
+    async def _file_content(self, file_id):
+        return SimpleNamespace(content=self._inputs[file_id])
+
+
+def _requests(n):
+    return [(str(i), {"model": "m", "messages": [{"role": "user", "content": str(i)}], "max_tokens": 10}) for i in range(n)]
+
+
+def test_empty_request_list_submits_nothing(tmp_path):
+    client = _FakeBatchClient(lambda custom_id, attempt: None)
+    assert asyncio.run(run_chat_batch(client, [], str(tmp_path))) == {}
+    assert client.submitted == []
+
+
+def test_failed_and_truncated_replies_are_dropped(tmp_path):
+    answers = {"0": (200, "ok", "stop"), "1": (500, "err", "stop"), "2": (200, '{"cut', "length")}
+    client = _FakeBatchClient(lambda custom_id, attempt: answers[custom_id])
+
+    results = asyncio.run(run_chat_batch(client, _requests(3), str(tmp_path)))
+
+    assert results == {"0": "ok"}
+    assert (tmp_path / "batch_input.jsonl").exists()
+    assert (tmp_path / "batch_output.jsonl").exists()
+
+
+def test_expired_batch_resubmits_only_missing_requests(tmp_path):
+    # 第一次提交超时但返回了部分结果，第二次只提交其余请求
+    def answer(custom_id, attempt):
+        if attempt == 0 and custom_id != "0":
+            return None
+        return 200, f"{custom_id}@{attempt}", "stop"
+
+    client = _FakeBatchClient(answer, statuses=("expired", "completed"))
+    results = asyncio.run(run_chat_batch(client, _requests(3), str(tmp_path)))
+
+    assert client.submitted == [["0", "1", "2"], ["1", "2"]]
+    assert results == {"0": "0@0", "1": "1@1", "2": "2@1"}
+    assert (tmp_path / "batch_input_1.jsonl").exists()
+
+
+def test_failed_batch_is_not_resubmitted(tmp_path):
+    client = _FakeBatchClient(lambda custom_id, attempt: None, statuses=("failed", "completed"))
+    assert asyncio.run(run_chat_batch(client, _requests(2), str(tmp_path))) == {}
+    assert len(client.submitted) == 1
@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+
+from utils import rate_limiter
+from utils.rate_limiter import TokenBucketLimiter, estimate_tokens
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """可控的单调时钟，asyncio.sleep推进时钟而不真正等待"""
+    state = {"now": 1000.0, "sleeps": []}
+
+    async def fake_sleep(seconds):
+        state["sleeps"].append(seconds)
+        state["now"] += seconds
+
+    monkeypatch.setattr(rate_limiter.time, "monotonic", lambda: state["now"])
+    monkeypatch.setattr(rate_limiter.asyncio, "sleep", fake_sleep)
+    return state
+
+
+def test_estimate_tokens():
+    messages = [{"role": "system", "content": "abcd"}, {"role": "user", "content": "123456"}]
+    assert estimate_tokens(messages, 100) == 105
+
+
+def test_acquire_does_not_wait_with_capacity(clock):
+    limiter = TokenBucketLimiter(60, 1000)
+
+    async def run():
+        for _ in range(10):
+            await limiter.acquire(50)
+
+    asyncio.run(run())
+    assert clock["sleeps"] == []
+    assert limiter.available_request_capacity == pytest.approx(50)
+    assert limiter.available_token_capacity == pytest.approx(500)
+
+
+def test_acquire_waits_for_request_refill(clock):
+    limiter = TokenBucketLimiter(60, 1000000)
+
+    async def run():
+        for _ in range(61):
+            await limiter.acquire(1)
+
+    asyncio.run(run())
+    # 60 RPM耗尽后，第61个请求等待1秒补充一个请求额度
+    assert sum(clock["sleeps"]) == pytest.approx(1)
+
+
+def test_acquire_waits_for_token_refill(clock):
+    limiter = TokenBucketLimiter(1000, 600)
+
+    async def run():
+        await limiter.acquire(600)
+        await limiter.acquire(300)
+
+    asyncio.run(run())
+    assert sum(clock["sleeps"]) == pytest.approx(30)
+
+
+def test_oversized_request_is_capped_to_bucket(clock):
+    limiter = TokenBucketLimiter(60, 100)
+    asyncio.run(limiter.acquire(10000))
+    assert clock["sleeps"] == []
+
+
+def test_update_from_headers_only_lowers_capacity(clock):
+    limiter = TokenBucketLimiter(60, 1000)
+    limiter.update_from_headers({"x-ratelimit-remaining-requests": "5", "x-ratelimit-remaining-tokens": "bad"})
+    assert limiter.available_request_capacity == 5
+    assert limiter.available_token_capacity == 1000
+
+    limiter.update_from_headers({"x-ratelimit-remaining-requests": "50"})
+    assert limiter.available_request_capacity == 5
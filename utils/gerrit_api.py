@@ -1,9 +1,42 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
 from urllib.parse import quote
-import json
-from typing import Dict, List, Optional
+import ijson
+import orjson
+from typing import Dict, Iterator, List, Optional
 import logging
 
+
+class _GerritStreamReader:
+    """把requests的原始响应流包装成ijson可读的文件对象，同时去掉Gerrit的)]}'前缀"""
+
+    def __init__(self, raw):
+        self._raw = raw
+        self._buffer = b""
+        self._prefix_checked = False
+
+    def read(self, size: int = -1) -> bytes:
+        if not self._prefix_checked:
+            # 前缀可能被拆在多次读取中，攒够4个有效字节再判断
+            while len(self._buffer.lstrip()) < 4:
+                chunk = self._raw.read(4)
+                if not chunk:
+                    break
+                self._buffer += chunk
+            self._buffer = self._buffer.lstrip()
+            if self._buffer.startswith(b")]}'"):
+                self._buffer = self._buffer[4:]
+            self._prefix_checked = True
+
+        if not self._buffer:
+            return self._raw.read(None if size is None or size < 0 else size)
+        if size is None or size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
 class GerritAPI:
     def __init__(self, api_root: str, username: str, password: str):
         """
@@ -22,6 +55,14 @@ class GerritAPI:
             "Content-Type": "application/json",
             "User-Agent": "GerritPythonClient/1.0"
         })
+        # 连接池复用keep-alive连接，服务端限流/5xx时自动退避重试
+        adapter = HTTPAdapter(
+            pool_connections=16,
+            pool_maxsize=32,
+            max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504])
+        )
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
         logging.info(f"GerritAPI initialized for {self.api_root}")
 
     def _make_request(self, endpoint: str, params: Optional[Dict] = None) -> Dict:
@@ -31,9 +72,9 @@ class GerritAPI:
             response = self.session.get(url, params=params, timeout=30)
             response.raise_for_status()
             
-            # Gerrit API响应以)]}'开头需要去除
-            content = response.text.lstrip(')]}\'\n')
-            return json.loads(content)
+            # Gerrit API响应以)]}'开头需要去除, 直接解析bytes避免解码为str
+            content = response.content.lstrip(b")]}'\n")
+            return orjson.loads(content)
         except requests.exceptions.RequestException as e:
             logging.error(f"API请求失败: {str(e)}")
             raise
@@ -55,6 +96,15 @@ class GerritAPI:
         """
         获取变更列表
         
+        :param query: 查询条件 (e.g. "status:open+project:gerritDemo+branch:master")
+        :param limit: 返回结果数量限制
+        """
+        return list(self.iter_changes(query, limit))
+
+    def iter_changes(self, query: str, limit: int = 100) -> Iterator[Dict]:
+        """
+        流式获取变更列表，边下载边逐个产出变更，不把整个响应体读入内存
+        
         :param query: 查询条件 (e.g. "status:open+project:gerritDemo+branch:master")
         :param limit: 返回结果数量限制
         """
@@ -62,7 +112,16 @@ class GerritAPI:
             'q': query,
             'n': limit
         }
-        return self._make_request("/changes/", params=params)
+        url = f"{self.api_root}/changes/"
+        try:
+            with self.session.get(url, params=params, timeout=30, stream=True) as response:
+                response.raise_for_status()
+                # 由urllib3负责gzip/deflate解压
+                response.raw.decode_content = True
+                yield from ijson.items(_GerritStreamReader(response.raw), 'item')
+        except requests.exceptions.RequestException as e:
+            logging.error(f"API请求失败: {str(e)}")
+            raise
 
     def get_change_detail(self, change_id: str) -> Dict:
         """
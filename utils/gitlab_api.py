@@ -1,5 +1,8 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
 from typing import Optional
+from urllib.parse import quote
 from .log import logger
 
 class GitLabAPI:
@@ -9,23 +12,34 @@ class GitLabAPI:
             'PRIVATE-TOKEN': token,
             'Content-Type': 'application/json'
         }
-        logger.debug(f"GitLabAPI初始化，根路径: {self.api_root}")
+        # 复用keep-alive连接，省去每次请求的TCP/TLS握手
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        # 重试用尽后返回最后一次响应(不抛RetryError)，由get_project_id按状态码报错
+        adapter = HTTPAdapter(
+            pool_connections=16,
+            pool_maxsize=32,
+            max_retries=Retry(
+                total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504], raise_on_status=False
+            )
+        )
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        logger.opt(lazy=True).debug("GitLabAPI初始化，根路径: {}", lambda: self.api_root)
 
     def get_project_id(self, project_path: str) -> int:
-        """通过项目路径获取数字ID"""
-        url = f"{self.api_root}/projects"
-        params = {'search': project_path, 'search_namespaces': True}
+        """通过项目路径获取数字ID(按URL编码的路径直接查询，不再遍历搜索结果)"""
+        url = f"{self.api_root}/projects/{quote(project_path, safe='')}"
         
-        logger.debug(f"查询项目URL: {url}, 参数: {params}")
-        response = requests.get(url, headers=self.headers, params=params, timeout=10)
+        logger.opt(lazy=True).debug("查询项目URL: {}", lambda: url)
+        response = self.session.get(url, timeout=10)
         
-        logger.debug(f"响应状态码: {response.status_code}")
+        logger.opt(lazy=True).debug("响应状态码: {}", lambda: response.status_code)
+        if response.status_code == 404:
+            raise ValueError(f"未找到项目: {project_path}")
         if response.status_code != 200:
             raise ValueError(f"API请求失败: HTTP {response.status_code}")
-            
-        for project in response.json():
-            if project['path_with_namespace'] == project_path:
-                logger.debug(f"找到项目: ID={project['id']}")
-                return project['id']
         
-        raise ValueError(f"未找到项目: {project_path}")
+        project_id = response.json()['id']
+        logger.opt(lazy=True).debug("找到项目: ID={}", lambda: project_id)
+        return project_id
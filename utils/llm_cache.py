@@ -0,0 +1,124 @@
+import asyncio
+import functools
+import hashlib
+import inspect
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+try:
+    import zstandard
+except ImportError:  # 未安装zstandard时以明文存储
+    zstandard = None
+
+# zstd帧头, 用于读取时区分压缩/未压缩的记录
+_ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+
+def make_cache_key(model: str, messages: List[Dict], temperature: float, max_tokens: int, **extra) -> str:
+    """根据模型、消息和采样参数计算确定性的缓存键, extra为response_format等其余请求参数"""
+    payload = {"m": model, "msgs": messages, "t": temperature, "mt": max_tokens}
+    if extra:
+        payload["x"] = extra
+    return hashlib.sha256(
+        json.dumps(payload, sort_keys=True, ensure_ascii=False).encode('utf-8')
+    ).hexdigest()
+
+
+class LLMCache:
+    def __init__(self, db_path: str = ".llm_cache.db"):
+        """
+        基于SQLite的持久化大模型响应缓存
+
+        :param db_path: SQLite数据库文件路径
+        """
+        self.db_path = db_path
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        # async调用方在线程池中读写, 同一连接上的语句与提交需串行执行
+        self._lock = threading.Lock()
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache "
+            "(key TEXT PRIMARY KEY, response BLOB, ts INTEGER)"
+        )
+        self._conn.commit()
+        self._compressor = zstandard.ZstdCompressor() if zstandard else None
+        self._decompressor = zstandard.ZstdDecompressor() if zstandard else None
+
+    def get(self, key: str) -> Optional[Any]:
+        """读取缓存, 未命中返回None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        data = row[0]
+        if data[:4] == _ZSTD_MAGIC:
+            if self._decompressor is None:
+                return None  # 由装有zstandard的环境写入, 当作未命中重新请求
+            data = self._decompressor.decompress(data)
+        return json.loads(data)
+
+    def set(self, key: str, value: Any) -> None:
+        """写入缓存(覆盖同键旧值)"""
+        data = json.dumps(value, ensure_ascii=False).encode('utf-8')
+        if self._compressor is not None:
+            data = self._compressor.compress(data)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, response, ts) VALUES (?, ?, ?)",
+                (key, data, int(time.time()))
+            )
+            self._conn.commit()
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+def cached_llm_call(func):
+    """
+    为 `func(self, model, messages, temperature, max_tokens, **extra)` 形式的大模型调用方法加缓存
+
+    缓存实例取自 `self.llm_cache`, 为None时直接调用; 同时支持同步和async方法,
+    async方法的缓存读写在线程中执行, 不阻塞事件循环。
+    只缓存正常返回的结果, 调用抛出的异常不会写入缓存。
+    调用时可传入 `cache_if=校验函数` (不参与缓存键), 返回内容校验不通过时照常返回但不写入缓存,
+    截断或格式错误的回答在下次运行时重新请求。
+    """
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(self, model, messages, temperature, max_tokens, **extra):
+            cache_if = extra.pop("cache_if", None)
+            cache = getattr(self, "llm_cache", None)
+            if cache is None:
+                return await func(self, model, messages, temperature, max_tokens, **extra)
+            key = make_cache_key(model, messages, temperature, max_tokens, **extra)
+            cached = await asyncio.to_thread(cache.get, key)
+            if cached is not None:
+                return cached
+            result = await func(self, model, messages, temperature, max_tokens, **extra)
+            if cache_if is None or cache_if(result):
+                await asyncio.to_thread(cache.set, key, result)
+            return result
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(self, model, messages, temperature, max_tokens, **extra):
+        cache_if = extra.pop("cache_if", None)
+        cache = getattr(self, "llm_cache", None)
+        if cache is None:
+            return func(self, model, messages, temperature, max_tokens, **extra)
+        key = make_cache_key(model, messages, temperature, max_tokens, **extra)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+        result = func(self, model, messages, temperature, max_tokens, **extra)
+        if cache_if is None or cache_if(result):
+            cache.set(key, result)
+        return result
+    return wrapper
+
+
+__all__ = ['LLMCache', 'cached_llm_call', 'make_cache_key']
@@ -7,22 +7,26 @@ log_dir = './logs'
 if not os.path.exists(log_dir):
     os.makedirs(log_dir)
 
+# debug.log默认记录DEBUG和ERROR日志；设置环境变量 LOG_DEBUG=0 后只记录ERROR
+_FILE_LEVEL = "ERROR" if os.environ.get("LOG_DEBUG", "1") == "0" else "DEBUG"
+
 # 配置全局logger
 logger.remove()
 
 # 调试日志写入文件
 logger.add(
     os.path.join(log_dir, 'debug.log'),
-    level="DEBUG",
-    rotation="5 MB",
+    level=_FILE_LEVEL,
+    rotation="50 MB",
     retention="1 day",
+    compression="gz",
     enqueue=True,
     backtrace=True,
     diagnose=True,
     filter=lambda record: record["level"].name in ["DEBUG", "ERROR"]
 )
 
-# 信息日志输出到控制台
+# 信息日志同步输出到控制台，与调用方的print保持先后顺序
 logger.add(
     sys.stdout,
     level="INFO",
@@ -1,4 +1,7 @@
 from lxml import etree
+
+# 不收集xml:id、不解析外部实体，减少大manifest的解析开销
+_PARSER = etree.XMLParser(collect_ids=False, resolve_entities=False, huge_tree=False)
 '''
 parse gerrit android manifest file to multi repo
 '''
@@ -8,18 +11,20 @@ class MParser():
     
     
     def run(self, content):
-        root = etree.fromstring(content)
-        root = list(root.iter('manifest'))[0]
+        root = etree.fromstring(content, parser=_PARSER)
+        if root.tag != 'manifest':
+            root = next(root.iter('manifest'))
         remotes = {}
         projects = []
         '''
         AOSP约定结构
         '''
         # TODO 深层次追踪
-        _includes = list(root.iter("include"))# 可选
+        # include/default/remote只查找manifest的直接子节点；project可以嵌套在project中，仍需遍历整棵树
+        _includes = root.findall("./include")# 可选
         _projects = list(root.iter("project"))# 至少一个
-        _default = list(root.iter("default"))# 可选，至多一个
-        _remotes = list(root.iter("remote"))# 至少一个
+        _default = root.findall("./default")# 可选，至多一个
+        _remotes = root.findall("./remote")# 至少一个
         # 1. 取remote
         for _rObj in _remotes:
             remotes[_rObj.get("name")] = _rObj.get("fetch")
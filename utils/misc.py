@@ -1,9 +1,26 @@
+import os
 import yaml
+from functools import lru_cache
 from typing import Dict, Any
 
+try:
+    from yaml import CSafeLoader as _Loader
+except ImportError:  # PyYAML未编译libyaml扩展时使用纯Python解析器
+    from yaml import SafeLoader as _Loader
+
+@lru_cache(maxsize=32)
+def _load_yaml_cached(abs_path: str, mtime: float) -> Dict[str, Any]:
+    # 以bytes读入，由解析器直接处理编码
+    with open(abs_path, 'rb') as f:
+        return yaml.load(f, Loader=_Loader)
+
 def load_yaml(file_path: str) -> Dict[str, Any]:
-    """加载YAML配置文件"""
-    with open(file_path, 'r', encoding='utf-8') as f:
-        return yaml.safe_load(f)
+    """
+    加载YAML配置文件
+    按(绝对路径, 修改时间)缓存解析结果，文件未变化时重复加载不再读盘解析；
+    返回的字典在调用方之间共享，不要原地修改
+    """
+    abs_path = os.path.abspath(file_path)
+    return _load_yaml_cached(abs_path, os.path.getmtime(abs_path))
 
 __all__ = ['load_yaml']
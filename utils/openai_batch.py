@@ -0,0 +1,105 @@
+import asyncio
+import os
+from typing import Dict, List, Tuple
+
+import orjson
+
+# 批处理任务的终止状态
+_TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+async def run_chat_batch(
+    client,
+    requests: List[Tuple[str, Dict]],
+    work_dir: str,
+    poll_interval: int = 60,
+    max_attempts: int = 3
+) -> Dict[str, str]:
+    """
+    通过OpenAI Batch API离线提交一批chat.completions请求并等待结果
+
+    :param client: AsyncOpenAI客户端
+    :param requests: (custom_id, 请求体)列表, 请求体即chat.completions.create的参数
+    :param work_dir: 存放输入/输出JSONL的目录
+    :param poll_interval: 轮询批处理状态的间隔(秒)
+    :param max_attempts: 批处理超时(expired)时最多提交的次数, 每次只重新提交尚未返回结果的请求
+    :return: custom_id -> 模型返回内容; 失败或被截断的请求不包含在结果中
+    """
+    if not requests:
+        return {}
+
+    os.makedirs(work_dir, exist_ok=True)
+    results = {}
+    pending = requests
+    for attempt in range(max_attempts):
+        suffix = f"_{attempt}" if attempt else ""
+        batch = await _run_batch(client, pending, os.path.join(work_dir, f"batch_input{suffix}.jsonl"), poll_interval)
+
+        # 未完成的批处理也可能带有部分结果的输出文件
+        if batch.output_file_id:
+            results.update(await _download_results(
+                client, batch.output_file_id, os.path.join(work_dir, f"batch_output{suffix}.jsonl")
+            ))
+        if batch.status == "completed":
+            break
+        print(f"批处理 {batch.id} 未成功完成: {batch.status}")
+        if batch.status != "expired":
+            break
+        pending = [(custom_id, body) for custom_id, body in pending if custom_id not in results]
+        if not pending:
+            break
+    return results
+
+
+async def _run_batch(client, requests: List[Tuple[str, Dict]], input_path: str, poll_interval: int):
+    """写出输入JSONL并提交批处理, 轮询到终止状态后返回批处理对象"""
+    with open(input_path, 'wb') as f:
+        for custom_id, body in requests:
+            f.write(orjson.dumps({
+                "custom_id": custom_id,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": body
+            }) + b"\n")
+
+    with open(input_path, 'rb') as f:
+        input_file = await client.files.create(file=f, purpose="batch")
+    batch = await client.batches.create(
+        input_file_id=input_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h"
+    )
+    print(f"已提交离线批处理 {batch.id}，共 {len(requests)} 个请求")
+
+    while batch.status not in _TERMINAL_STATUSES:
+        await asyncio.sleep(poll_interval)
+        batch = await client.batches.retrieve(batch.id)
+        counts = batch.request_counts
+        if counts is not None:
+            print(f"批处理 {batch.id} 状态: {batch.status} ({counts.completed}/{counts.total})")
+    return batch
+
+
+async def _download_results(client, output_file_id: str, output_path: str) -> Dict[str, str]:
+    """下载批处理输出文件, 返回成功请求的custom_id -> 模型返回内容"""
+    output = await client.files.content(output_file_id)
+    with open(output_path, 'wb') as f:
+        f.write(output.content)
+
+    results = {}
+    for line in output.content.splitlines():
+        if not line.strip():
+            continue
+        record = orjson.loads(line)
+        response = record.get("response") or {}
+        if response.get("status_code") != 200:
+            continue
+        choice = response["body"]["choices"][0]
+        # 达到max_tokens被截断的回答按失败处理, 不交给调用方解析和缓存
+        if choice.get("finish_reason") == "length":
+            continue
+        results[record["custom_id"]] = choice["message"]["content"]
+    return results
+
+
+__all__ = ['run_chat_batch']
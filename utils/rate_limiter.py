@@ -0,0 +1,80 @@
+import asyncio
+import time
+from typing import Dict, List, Mapping, Optional
+
+
+def estimate_tokens(messages: List[Dict], max_tokens: int) -> int:
+    """粗略估算一次请求消耗的token数: 提示词按每2个字符1个token(中英文混合)加上最大输出token"""
+    chars = sum(len(m.get("content") or "") for m in messages)
+    return chars // 2 + max_tokens
+
+
+class TokenBucketLimiter:
+    def __init__(self, max_requests_per_minute: float, max_tokens_per_minute: float):
+        """
+        基于令牌桶的主动限流: 请求数和token数两个桶按每分钟额度匀速补充,
+        只有额度即将耗尽时才等待, 不再固定sleep
+
+        :param max_requests_per_minute: 每分钟请求数上限(RPM)
+        :param max_tokens_per_minute: 每分钟token数上限(TPM)
+        """
+        self.max_requests = max_requests_per_minute
+        self.max_tokens = max_tokens_per_minute
+        self.available_request_capacity = max_requests_per_minute
+        self.available_token_capacity = max_tokens_per_minute
+        self._last_update = time.monotonic()
+        # 等待额度的请求按到达顺序依次放行
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self._last_update
+        self._last_update = now
+        self.available_request_capacity = min(
+            self.max_requests,
+            self.available_request_capacity + self.max_requests * elapsed / 60
+        )
+        self.available_token_capacity = min(
+            self.max_tokens,
+            self.available_token_capacity + self.max_tokens * elapsed / 60
+        )
+
+    async def acquire(self, tokens: int) -> None:
+        """占用1个请求额度和tokens个token额度, 不足时等待补充"""
+        # 单次请求超过整个桶容量时按桶容量计, 避免永远等待
+        tokens = min(tokens, self.max_tokens)
+        async with self._lock:
+            while True:
+                self._refill()
+                request_deficit = 1 - self.available_request_capacity
+                token_deficit = tokens - self.available_token_capacity
+                if request_deficit <= 0 and token_deficit <= 0:
+                    break
+                await asyncio.sleep(max(
+                    request_deficit * 60 / self.max_requests,
+                    token_deficit * 60 / self.max_tokens
+                ))
+            self.available_request_capacity -= 1
+            self.available_token_capacity -= tokens
+
+    def update_from_headers(self, headers: Mapping[str, str]) -> None:
+        """根据响应头 x-ratelimit-remaining-* 修正本地估算, 服务端剩余额度更少时以服务端为准"""
+        remaining_requests = _header_number(headers, "x-ratelimit-remaining-requests")
+        remaining_tokens = _header_number(headers, "x-ratelimit-remaining-tokens")
+        if remaining_requests is not None:
+            self.available_request_capacity = min(self.available_request_capacity, remaining_requests)
+        if remaining_tokens is not None:
+            self.available_token_capacity = min(self.available_token_capacity, remaining_tokens)
+
+
+def _header_number(headers: Mapping[str, str], name: str) -> Optional[float]:
+    value = headers.get(name)
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+__all__ = ['TokenBucketLimiter', 'estimate_tokens']
@@ -0,0 +1,79 @@
+import json
+import os
+import threading
+from typing import Any, Optional
+
+
+class SemanticCache:
+    def __init__(self, path: str, threshold: float = 0.95, model_name: str = "all-MiniLM-L6-v2"):
+        """
+        基于向量相似度的语义缓存: 文本嵌入后在FAISS索引中查找最近邻,
+        余弦相似度超过阈值即复用之前的结果。嵌入模型会截断超过max_seq_length(all-MiniLM-L6-v2为256个word-piece)
+        的输入，截断处之后不同的文本会得到几乎相同的向量，因此这类文本既不查询也不写入
+
+        :param path: 缓存文件前缀, 索引保存为 `{path}.faiss`, 元数据保存为 `{path}.json`
+        :param threshold: 命中所需的最小余弦相似度
+        :param model_name: sentence-transformers嵌入模型名称
+        """
+        # 依赖较重, 仅在启用语义缓存时导入; 缺失时由调用方捕获ImportError后关闭该功能
+        import faiss
+        import numpy as np
+        from sentence_transformers import SentenceTransformer
+
+        self._faiss = faiss
+        self._np = np
+        self.threshold = threshold
+        self.index_path = f"{path}.faiss"
+        self.meta_path = f"{path}.json"
+        self._model = SentenceTransformer(model_name)
+        # 调用方可能在多个线程中并发lookup/add, 索引与元数据需保持一一对应
+        self._lock = threading.Lock()
+        dim = self._model.get_sentence_embedding_dimension()
+
+        if os.path.exists(self.index_path) and os.path.exists(self.meta_path):
+            self._index = faiss.read_index(self.index_path)
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                self._values = json.load(f)
+        else:
+            # 向量已归一化, 内积即余弦相似度
+            self._index = faiss.IndexFlatIP(dim)
+            self._values = []
+
+    def _fits(self, text: str) -> bool:
+        """文本能否不经截断完整嵌入"""
+        ids = self._model.tokenizer(text, verbose=False)["input_ids"]
+        return len(ids) <= self._model.max_seq_length
+
+    def _embed(self, text: str):
+        vec = self._model.encode([text], normalize_embeddings=True)
+        return self._np.asarray(vec, dtype='float32')
+
+    def lookup(self, text: str) -> Optional[Any]:
+        """查找语义最相近的已缓存结果, 相似度不足阈值或文本过长时返回None"""
+        if self._index.ntotal == 0 or not self._fits(text):
+            return None
+        vec = self._embed(text)
+        with self._lock:
+            scores, ids = self._index.search(vec, 1)
+            if scores[0][0] >= self.threshold:
+                return self._values[ids[0][0]]
+        return None
+
+    def add(self, text: str, value: Any) -> None:
+        """写入一条结果(value需可JSON序列化), 文本过长时跳过"""
+        if not self._fits(text):
+            return
+        vec = self._embed(text)
+        with self._lock:
+            self._index.add(vec)
+            self._values.append(value)
+
+    def save(self) -> None:
+        """持久化索引和元数据"""
+        with self._lock:
+            self._faiss.write_index(self._index, self.index_path)
+            with open(self.meta_path, 'w', encoding='utf-8') as f:
+                json.dump(self._values, f, ensure_ascii=False)
+
+
+__all__ = ['SemanticCache']